@@ -0,0 +1,251 @@
+# coding: utf-8
+
+import json
+import subprocess
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+from sys import exit
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+import cv2
+
+from tools import Tile, detect_section, detect_section_s100, \
+  section_area, section_mask_accuracy, process_vessels, process_image, \
+  processing_types, get_portion, Box, synthetic_tile, FakeSlide, \
+  apply_morphology
+
+# The downsample factors of the section detection that are benchmarked
+mask_downsamples = (2, 4, 8)
+
+# The default file where the results of the successive runs are recorded
+history_file_name = 'benchmark_history.jsonl'
+
+
+def get_benchmarks(size: int,
+                   density: float,
+                   folder: Path) -> Dict[str, Tuple[Callable[[], object],
+                                                    int]]:
+  """Builds the functions to benchmark, all working on the same synthetic
+  tile.
+
+  Args:
+    size: The width and height of the synthetic tile in pixels.
+    density: The number of stained objects per megapixel.
+    folder: A temporary folder where to write the encoded tile.
+
+  Returns:
+    For each benchmark name, the function to time and the number of pixels it
+    processes.
+  """
+
+  tile = synthetic_tile(size, size, density)
+  pixels = size * size
+
+  # The encoded tile, for the decoding benchmark
+  png_path = folder / 'tile.png'
+  Image.fromarray(tile).save(png_path)
+
+  # A fake slide whose 4x4 subsections are of the size of the tile
+  slide = FakeSlide((16 * size, 16 * size), density=density)
+  thumb_factor = 4
+  label = Box((0, 0, size // 4, size // 4))
+
+  benchmarks = {
+    'png decode': (lambda: Tile.open(png_path), pixels),
+    'png encode': (lambda: Image.fromarray(tile).save(BytesIO(), 'png'),
+                   pixels),
+    'get_portion': (lambda: get_portion(slide, label, thumb_factor, 4, 1, 1),
+                    pixels),
+    'detect_section': (lambda: detect_section(tile), pixels),
+    'detect_section_s100': (lambda: detect_section_s100(tile), pixels),
+    'process_vessels': (lambda: process_vessels(Tile(tile)), pixels)}
+
+  # The large morphological operations, on a mask only containing 0 and 255
+  mask = detect_section(tile).copy()
+  for operation, name, size in ((cv2.MORPH_DILATE, 'dilate', 20),
+                                (cv2.MORPH_CLOSE, 'close', 70)):
+    benchmarks[f'morphology {name} {size}x{size}'] = (
+      lambda operation=operation, size=size: apply_morphology(
+        mask, operation, size, binary=True), pixels)
+
+  # The section detection on shrunk images
+  for factor in mask_downsamples:
+    benchmarks[f'detect_section[x{factor}]'] = (
+      lambda factor=factor: detect_section(tile, factor), pixels)
+    benchmarks[f'section_area[x{factor}]'] = (
+      lambda factor=factor: section_area(tile, None, factor), pixels)
+    benchmarks[f'detect_section_s100[x{factor}]'] = (
+      lambda factor=factor: detect_section_s100(tile, factor), pixels)
+
+  # The complete processing of each stain, on a fresh Tile every time
+  for choice in processing_types:
+    benchmarks[f'process_image[{choice}]'] = (
+      lambda choice=choice: process_image(Tile(tile), choice), pixels)
+
+  return benchmarks
+
+
+def measure(func: Callable[[], object], repeat: int) -> Tuple[float, int]:
+  """Times a function and measures its peak memory allocation.
+
+  The timing runs are performed without tracing the allocations, which would
+  slow them down, and the peak allocation is measured on an extra run.
+
+  Args:
+    func: The function to measure.
+    repeat: The number of timing runs, the fastest one being kept.
+
+  Returns:
+    The best wall time in seconds, and the peak allocation in bytes.
+  """
+
+  times = list()
+  for _ in range(repeat):
+    start = perf_counter()
+    func()
+    times.append(perf_counter() - start)
+
+  tracemalloc.start()
+  func()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return min(times), peak
+
+
+def get_commit() -> Optional[str]:
+  """Returns the current git commit of the repository, if available."""
+
+  try:
+    return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                          capture_output=True, text=True, check=True,
+                          cwd=Path(__file__).parent).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def load_history(path: Path) -> List[dict]:
+  """Reads the results of the previous runs, one JSON object per line."""
+
+  try:
+    with open(path, 'r') as file:
+      return [json.loads(line) for line in file if line.strip()]
+  except FileNotFoundError:
+    return list()
+
+
+def find_reference(history: List[dict],
+                   size: int,
+                   density: float) -> Dict[str, dict]:
+  """Returns the most recent result of each benchmark among the previous runs
+  performed with the same tile size and object density."""
+
+  reference = dict()
+  for run in history:
+    if run.get('size') == size and run.get('density') == density:
+      reference.update(run.get('results', dict()))
+  return reference
+
+
+if __name__ == '__main__':
+
+  parser = ArgumentParser(description="Measures the throughput and the peak "
+                                      "memory of the image processing "
+                                      "functions on synthetic tiles, and "
+                                      "compares them to the previous runs.")
+  parser.add_argument('--size', type=int, default=2048,
+                      help="The width and height of the synthetic tiles in "
+                           "pixels. Defaults to 2048.")
+  parser.add_argument('--density', type=float, default=50.,
+                      help="The number of stained objects per megapixel. "
+                           "Defaults to 50.")
+  parser.add_argument('--repeat', type=int, default=3,
+                      help="The number of timing runs of each benchmark, the "
+                           "fastest one being kept. Defaults to 3.")
+  parser.add_argument('--only', nargs='+', default=None,
+                      help="Only runs the benchmarks whose name contains one "
+                           "of the given strings.")
+  parser.add_argument('--history', type=Path,
+                      default=Path(__file__).parent / history_file_name,
+                      help="The file where the results of the successive "
+                           f"runs are recorded, defaults to "
+                           f"{history_file_name} next to this script.")
+  parser.add_argument('--no-record', action='store_true',
+                      help="Does not record the results of this run.")
+  parser.add_argument('--tolerance', type=float, default=0.2,
+                      help="The relative loss of throughput compared to the "
+                           "previous run above which a regression is "
+                           "reported. Defaults to 0.2.")
+  parser.add_argument('--fail-on-regression', action='store_true',
+                      help="Exits with an error code if a regression is "
+                           "detected.")
+  parser.add_argument('--mask-accuracy', action='store_true',
+                      help="Also compares the section areas detected on "
+                           "shrunk tiles to the full resolution ones.")
+  args = parser.parse_args()
+
+  history = load_history(args.history)
+  reference = find_reference(history, args.size, args.density)
+
+  results = dict()
+  regressions = list()
+  print(f"{'Benchmark':<30} {'MP/s':>9} {'Peak MB':>9} {'Previous':>9}")
+
+  with TemporaryDirectory() as tmp_dir:
+    benchmarks = get_benchmarks(args.size, args.density, Path(tmp_dir))
+
+    for name, (func, pixels) in benchmarks.items():
+      if args.only and not any(part in name for part in args.only):
+        continue
+
+      seconds, peak = measure(func, args.repeat)
+      results[name] = {'seconds': seconds,
+                       'mpx_s': pixels / 1e6 / seconds,
+                       'peak_mb': peak / 2 ** 20}
+
+      # Comparing to the previous run
+      previous = reference.get(name, dict()).get('mpx_s')
+      flag = ''
+      if previous is not None and \
+          results[name]['mpx_s'] < (1 - args.tolerance) * previous:
+        regressions.append(name)
+        flag = '  REGRESSION'
+
+      print(f"{name:<30} {results[name]['mpx_s']:>9.2f} "
+            f"{results[name]['peak_mb']:>9.1f} "
+            f"{previous if previous is not None else float('nan'):>9.2f}"
+            f"{flag}")
+
+  # Comparing the section detection on shrunk tiles to the full resolution
+  if args.mask_accuracy:
+    tile = synthetic_tile(args.size, args.size, args.density)
+    print(f"\n{'Section detection':<30} {'Area error':>11} {'IoU':>9}")
+    for s100 in (False, True):
+      for factor in mask_downsamples:
+        accuracy = section_mask_accuracy(tile, factor, s100)
+        name = f"detect_section{'_s100' if s100 else ''}[x{factor}]"
+        print(f"{name:<30} {100 * accuracy['area_error']:>10.3f}% "
+              f"{accuracy['iou']:>9.4f}")
+
+  # Recording the results for the next runs
+  if not args.no_record:
+    with open(args.history, 'a') as file:
+      file.write(json.dumps({'date': datetime.now().isoformat(
+                                timespec='seconds'),
+                             'commit': get_commit(),
+                             'size': args.size,
+                             'density': args.density,
+                             'numpy': np.__version__,
+                             'results': results}) + '\n')
+
+  if regressions:
+    print(f"Regressions detected on : {', '.join(regressions)}")
+    if args.fail_on_regression:
+      exit(1)
@@ -1,10 +1,10 @@
 # coding: utf-8
 
 import numpy as np
-from tools import select_folder
+from tools import select_folder, find_data_files, load_folder_areas
 import tkinter as tk
 from sys import exit
-from openpyxl import load_workbook
+from concurrent.futures import ProcessPoolExecutor
 from matplotlib import pyplot as plt
 
 if __name__ == '__main__':
@@ -22,23 +22,25 @@ if __name__ == '__main__':
     exit()
 
   folders = [dir_ for dir_ in base_folder.iterdir()
-             if list(dir_.rglob('*.xlsx'))]
+             if dir_.is_dir() and find_data_files(dir_)]
 
-  for folder in folders:
+  # Loading the areas of all the folders in parallel, in a single pass
+  with ProcessPoolExecutor() as executor:
+    all_areas = list(executor.map(load_folder_areas, folders))
 
-    data_files = list(folder.rglob('*.xlsx'))
+  for folder_areas in all_areas:
 
-    min_area = float('inf')
-    max_area = 0
+    # Converting the areas from pixels to square micrometers
+    folder_areas = [(name, values * 0.221 * 0.221,
+                     overall_area * 0.221 * 0.221)
+                    for name, values, overall_area in folder_areas]
 
-    for file in data_files:
-      workbook = load_workbook(file)
-      sheet = workbook.active
-      values = np.array([*list(*sheet.iter_cols(min_col=3, max_col=3,
-                                                values_only=True))][1:])
-      values = values * 0.221 * 0.221
-      min_area = min(min_area, np.min(values))
-      max_area = max(max_area, np.max(values))
+    non_empty = [values for _, values, _ in folder_areas if values.size]
+    if not non_empty:
+      continue
+    min_area = min(np.min(values) for values in non_empty)
+    max_area = max(np.max(values) for values in non_empty)
+    bins = np.logspace(np.log10(min_area), np.log10(max_area), 75)
 
     colors = ['b', 'r', 'g']
     labels = []
@@ -47,26 +49,17 @@ if __name__ == '__main__':
     ax1 = fig.add_subplot(2, 1, 1)
     ax2 = fig.add_subplot(2, 1, 2)
 
-    for color, file in zip(colors, data_files):
+    for color, (name, values, overall_area) in zip(colors, folder_areas):
 
-      workbook = load_workbook(file)
-      sheet = workbook.active
-      values = np.array([*list(*sheet.iter_cols(min_col=3, max_col=3,
-                                                values_only=True))][1:])
-      values = values * 0.221 * 0.221
-      overall_area = sheet['F2'].value * 0.221 * 0.221
+      # Computing the histograms directly from the arrays
+      val, _ = np.histogram(values, bins=bins)
+      ax1.stairs(val, bins, linewidth=1.2, edgecolor=color, fill=False)
 
-      bins = np.logspace(np.log10(min_area), np.log10(max_area), 75)
+      val = val / overall_area
 
-      val, bins, _ = ax1.hist(values, density=False, alpha=1, linewidth=1.2,
-                              edgecolor=color, bins=bins, facecolor='None',
-                              histtype='step')
-
-      val /= overall_area
-
-      ax2.hist(bins[1:], bins[1:], weights=val, density=False, alpha=1,
-               linewidth=1.2, edgecolor=color, facecolor='None',
-               histtype='step')
+      # Same binning as plotting the normalized values at the upper edges
+      val, _ = np.histogram(bins[1:], bins[1:], weights=val)
+      ax2.stairs(val, bins[1:], linewidth=1.2, edgecolor=color, fill=False)
 
       ax1.set_xscale('log')
       ax1.set_yscale('log')
@@ -75,7 +68,7 @@ if __name__ == '__main__':
       ax2.set_xscale('log')
       ax2.set_yscale('log')
       ax2.set_ylabel('Items per square micrometer')
-      labels.append(file.parent.stem)
+      labels.append(name)
     ax1.legend(labels)
     ax2.legend(labels)
     plt.show()
@@ -1,310 +1,243 @@
 # coding: utf-8
 
-import numpy as np
-from PIL import Image
-from skimage import measure, segmentation, morphology
 import tkinter as tk
 from pathlib import Path
-from xlsxwriter import Workbook
+from argparse import ArgumentParser
 from sys import exit
-from gc import collect
-import cv2
+from os import cpu_count
 
-from tools import Progress_window, select_folder, detect_section, \
-  process_vessels, Processing_choice
+from tools import Progress_window, Progress_console, select_folder, \
+  Processing_choice, processing_types, process_side_folders, \
+  process_slides, get_section_folders, get_side_folders, load_job, \
+  load_sections, sections_file_name, enable_tracing, save_trace, summarize, \
+  OverlayOptions, overlay_codecs, check_memory_budget
 
 if __name__ == '__main__':
 
-  # Base hidden window, necessary for using the TopLevel
-  root = tk.Tk()
-  root.withdraw()
-
-  # Selecting the working folder
-  folder = select_folder()
-
-  # In case the user wants to cancel
-  if folder is None:
-    root.destroy()
-    exit()
-
-  # Selecting the type of processing to perform
-  choice = tk.StringVar(value='')
-  ok = tk.BooleanVar(value=False)
-  Processing_choice(choice, ok)
-  root.wait_variable(ok)
-
-  # In case the user wants to cancel
-  if not choice.get():
-    root.destroy()
-    exit()
+  # Arguments for running the processing without any user interaction
+  parser = ArgumentParser(description="Processes the subsections extracted "
+                                      "by selection.py. Without any argument, "
+                                      "the folder and the type of processing "
+                                      "are selected in popup windows.")
+  parser.add_argument('folder', nargs='?', type=Path, default=None,
+                      help="The working directory, containing one folder per "
+                           ".ndpi file. Setting it enables the headless "
+                           "mode.")
+  parser.add_argument('--stain', choices=processing_types, default=None,
+                      help="The type of processing to perform, mandatory in "
+                           "headless mode.")
+  parser.add_argument('--job', type=Path, default=None,
+                      help="A JSON job file providing the folder, stain, "
+                           "workers, from_slides, sections, save_raw, halo, "
+                           "memory_budget, min_coverage, no_excel, restart, "
+                           "trace, overlay, overlay_level, "
+                           "overlay_downsample, pyramid, pyramid_raw and "
+                           "mask_downsample keys. "
+                           "Command-line arguments take precedence.")
+  parser.add_argument('--workers', type=int, default=None,
+                      help="The number of worker processes processing the "
+                           "subsections in parallel, 0 for one per CPU. Each "
+                           "worker holds an entire subsection in memory. "
+                           "Defaults to 1, i.e. sequential processing.")
+  parser.add_argument('--from-slides', action='store_true',
+                      help="Reads the sections directly from the .ndpi files "
+                           "of the working directory instead of the .png "
+                           "images written by selection.py.")
+  parser.add_argument('--sections', type=Path, default=None,
+                      help="With --from-slides, the JSON file containing the "
+                           "sections to process on each slide, defaults to "
+                           f"{sections_file_name} in the working directory.")
+  parser.add_argument('--save-raw', action='store_true',
+                      help="With --from-slides, also saves the subsections "
+                           "read from the slides in the Raw_images folders.")
+  parser.add_argument('--halo', type=int, default=None,
+                      help="With --from-slides, the number of pixels by which "
+                           "each subsection overlaps with its neighbours. It "
+                           "should be larger than the largest objects to "
+                           "detect. Defaults to 0.")
+  parser.add_argument('--memory-budget', type=float, default=None,
+                      help="With --from-slides, the maximum memory in MB for "
+                           "processing one subsection. If given, each section "
+                           "is cut into as many subsections as needed for "
+                           "fitting in it. Defaults to cutting each section "
+                           "into 4x4 subsections.")
+  parser.add_argument('--min-coverage', type=float, default=None,
+                      help="With --from-slides, the minimum fraction of a "
+                           "subsection covered by tissue, as estimated on the "
+                           "slide thumbnail. The subsections below it are not "
+                           "read, and only their estimated tissue area is "
+                           "counted. Defaults to 0, i.e. no subsection is "
+                           "skipped.")
+  parser.add_argument('--no-excel', action='store_true',
+                      help="Only writes the results to the data.npz files, "
+                           "and not to the data.xlsx ones.")
+  parser.add_argument('--restart', action='store_true',
+                      help="Processes again all the subsections, instead of "
+                           "skipping the ones already processed by a previous "
+                           "run.")
+  parser.add_argument('--trace', type=Path, default=None,
+                      help="Records the wall time, CPU time and peak memory "
+                           "allocation of each processing stage of each "
+                           "subsection, and writes them to the given file in "
+                           "the Chrome trace format. It can be opened in "
+                           "chrome://tracing or in Perfetto. Tracing the "
+                           "memory slows down the processing.")
+  parser.add_argument('--overlay', choices=(*overlay_codecs, 'none'),
+                      default=None,
+                      help="The format of the processed images written to "
+                           "the Processed_images folders. bmp and tiff are "
+                           "uncompressed and the fastest to write, none "
+                           "disables writing them. Defaults to png.")
+  parser.add_argument('--overlay-level', type=int, default=None,
+                      help="The compression level of the png processed "
+                           "images, from 0 for no compression to 9 for the "
+                           "smallest files. 1 is much faster than the default "
+                           "6 for slightly larger files.")
+  parser.add_argument('--overlay-downsample', type=int, default=None,
+                      help="The factor by which the processed images are "
+                           "shrunk along both axes before being written. "
+                           "Defaults to 1, i.e. full resolution.")
+  parser.add_argument('--pyramid', action='store_true',
+                      help="Also assembles the processed images of each side "
+                           "folder into a single tiled and multi-resolution "
+                           "TIFF image, Processed_images.tif, that viewers "
+                           "can zoom in without decoding it entirely.")
+  parser.add_argument('--pyramid-raw', action='store_true',
+                      help="Also assembles the raw images of each side "
+                           "folder into a pyramidal Raw_images.tif image, if "
+                           "the Raw_images folder exists.")
+  parser.add_argument('--mask-downsample', type=int, default=None,
+                      help="The factor by which the subsections are shrunk "
+                           "for detecting the section areas when counting "
+                           "the overall area, which is much faster at the "
+                           "cost of a slightly less accurate area. Defaults "
+                           "to 1, i.e. full resolution.")
+  args = parser.parse_args()
+
+  job = load_job(args.job)
+  folder = args.folder if args.folder is not None else job.get('folder')
+  choice = args.stain if args.stain is not None else job.get('stain')
+  workers = args.workers if args.workers is not None \
+    else job.get('workers', 1)
+  if workers < 1:
+    workers = cpu_count() or 1
+  from_slides = args.from_slides or job.get('from_slides', False)
+  save_raw = args.save_raw or job.get('save_raw', False)
+  halo = args.halo if args.halo is not None else job.get('halo', 0)
+  memory_budget = args.memory_budget if args.memory_budget is not None \
+    else job.get('memory_budget')
+  if memory_budget is not None:
+    memory_budget *= 2 ** 20
+    try:
+      check_memory_budget(memory_budget, halo)
+    except ValueError as error:
+      parser.error(str(error))
+  min_coverage = args.min_coverage if args.min_coverage is not None \
+    else job.get('min_coverage', 0.)
+  excel = not (args.no_excel or job.get('no_excel', False))
+  resume = not (args.restart or job.get('restart', False))
+  trace = args.trace if args.trace is not None else job.get('trace')
+  codec = args.overlay if args.overlay is not None \
+    else job.get('overlay', 'png')
+  try:
+    overlay = OverlayOptions(
+      codec=None if codec == 'none' else codec,
+      level=args.overlay_level if args.overlay_level is not None
+      else job.get('overlay_level'),
+      downsample=args.overlay_downsample
+      if args.overlay_downsample is not None
+      else job.get('overlay_downsample', 1),
+      pyramid=args.pyramid or job.get('pyramid', False),
+      pyramid_raw=args.pyramid_raw or job.get('pyramid_raw', False))
+  except ValueError as error:
+    parser.error(str(error))
+  mask_downsample = args.mask_downsample \
+    if args.mask_downsample is not None else job.get('mask_downsample', 1)
+  if mask_downsample < 1:
+    parser.error(f"The mask downsample factor should be at least 1, got "
+                 f"{mask_downsample}")
+  headless = folder is not None
+
+  if headless:
+    folder = Path(folder)
+    if not folder.is_dir():
+      parser.error(f"The folder {folder} does not exist !")
+    if choice not in processing_types:
+      parser.error(f"A valid stain should be given in headless mode, "
+                   f"among : {', '.join(processing_types)}")
+
+  else:
+    # Base hidden window, necessary for using the TopLevel
+    root = tk.Tk()
+    root.withdraw()
+
+    # Selecting the working folder
+    folder = select_folder()
+
+    # In case the user wants to cancel
+    if folder is None:
+      root.destroy()
+      exit()
+
+    # Selecting the type of processing to perform
+    choice_var = tk.StringVar(value='')
+    ok = tk.BooleanVar(value=False)
+    Processing_choice(choice_var, ok)
+    root.wait_variable(ok)
+    choice = choice_var.get()
+
+    # In case the user wants to cancel
+    if not choice:
+      root.destroy()
+      exit()
+
+  # Getting the sections to read from the .ndpi images
+  if from_slides:
+    sections = args.sections if args.sections is not None \
+      else job.get('sections', folder / sections_file_name)
+    try:
+      sections = load_sections(sections)
+    except FileNotFoundError:
+      parser.error(f"No sections file found at {sections} !")
+    chosen_images = {file: sections[file.stem] for file in folder.iterdir()
+                     if file.suffix == '.ndpi' and file.stem in sections}
 
   # Getting all the sub-folders containing the .png images
-  folders = [fold for fold in folder.iterdir() if fold.is_dir()
-             and list(fold.rglob('*.png'))]
-  nb_fold = sum((len([dir_ for dir_ in fold.iterdir() if dir_.is_dir()
-                      and list(dir_.rglob('*.png'))]) for fold in folders))
-  fold_count = 0
-
-  # Creating the progress bar window
-  progress = Progress_window('Processed sections :',
-                             'Processed subsections :')
-
-  # Iterating over all the folders
-  for fold in folders:
-
-    print(f"Now processing the section : {fold.stem}")
-
-    # iterating over all the sub-folders containing .png images
-    for side_fold in [dir_ for dir_ in fold.iterdir() if dir_.is_dir()
-                      and list(dir_.rglob('*.png'))]:
-
-      # Updating the progress bar
-      progress.top_progress.set(int(100 * fold_count / nb_fold))
-      progress.update()
-      fold_count += 1
-      nb_img = len(list((side_fold / 'Raw_images').glob('*.png')))
-
-      # Creating the Excel data sheet
-      Path.mkdir(side_fold / 'Processed_images', exist_ok=True, parents=True)
-
-      # Processing for the blood vessel detection
-      if choice.get() == 'Blood vessels':
-
-        # Filling the labels in the data sheet
-        with Workbook(str(side_fold / 'data.xlsx')) as excel:
-          worksheet = excel.add_worksheet()
-          bold = excel.add_format({'bold': True, 'align': 'center'})
-          worksheet.write(0, 0, "Vessel index", bold)
-          worksheet.write(0, 1, "Vessel smaller diameter", bold)
-          worksheet.write(0, 2, "Vessel area", bold)
-          worksheet.write(0, 3, "Vessel perimeter", bold)
-          worksheet.write(0, 4, "", bold)
-          worksheet.write(0, 5, "Overall area", bold)
-          index = 1
-
-          overall_area = 0
-
-          # Iterating over the subsections for processing
-          for i, image_path in enumerate((side_fold /
-                                          'Raw_images').glob('*.png')):
-
-            # Updating the progress bar
-            progress.bottom_progress.set(int(100 * i / nb_img))
-            progress.update()
-
-            # Opening the subsection
-            img = Image.open(image_path)
-            img_npy = np.array(img)
-
-            # Counting the overall area
-            overall_area += np.count_nonzero(detect_section(img_npy))
-
-            # Detecting the blood vessels
-            labels = process_vessels(img)
-            del img
-
-            # Saving the outline image
-            image_outline = segmentation.mark_boundaries(img_npy[:, :, :3],
-                                                         labels,
-                                                         color=(0, 1, 0))
-            del img_npy
-            image_outline = (255 * image_outline).astype('uint8')
-            Image.fromarray(image_outline).save(side_fold /
-                                                'Processed_images' /
-                                                image_path.name)
-            del image_outline
-
-            # Calculating the vessels properties and storing them in the Excel
-            label_props = measure.regionprops(labels)
-            del labels
-            for prop in label_props:
-              worksheet.write(index, 0, index)
-              worksheet.write(index, 1, prop.axis_minor_length)
-              worksheet.write(index, 2, prop.area_filled)
-              worksheet.write(index, 3, prop.perimeter)
-              index += 1
-
-            # Ensuring the memory is freed
-            collect()
-
-          # Finally, writing the overall section area
-          worksheet.write(1, 5, overall_area)
-
-      elif choice.get() == 'S100':
-
-        # Filling the labels in the data sheet
-        with Workbook(str(side_fold / 'data.xlsx')) as excel:
-          worksheet = excel.add_worksheet()
-          bold = excel.add_format({'bold': True, 'align': 'center'})
-          worksheet.write(0, 0, "Bundle index", bold)
-          worksheet.write(0, 1, "Bundle smaller diameter", bold)
-          worksheet.write(0, 2, "Bundle area", bold)
-          worksheet.write(0, 3, "Bundle perimeter", bold)
-          worksheet.write(0, 4, "", bold)
-          worksheet.write(0, 5, "Overall area", bold)
-          index = 1
-
-          overall_area = 0
-
-          # Iterating over the subsections for processing
-          for i, image_path in enumerate((side_fold /
-                                          'Raw_images').glob('*.png')):
-
-            # Updating the progress bar
-            progress.bottom_progress.set(int(100 * i / nb_img))
-            progress.update()
-
-            # Opening the subsection
-            img = Image.open(image_path)
-            img_npy = np.array(img)
-
-            # Counting the overall area
-            overall_area += np.count_nonzero(detect_section(img_npy))
-
-            img = np.array(img.convert('YCbCr'))[:, :, 2]
-            upper, lower = np.percentile(img, 99.5), np.percentile(img, 50)
-            upper = max(138, upper)
-            img = np.clip((img - lower) / (upper - lower) * 255, 0,
-                          255).astype('uint8')
-            mask = ((img > 180) * 255).astype('uint8')
-            del img
-            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5, 5)))
-            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((70, 70)))
-            labels = measure.label(mask, background=0, connectivity=2)
-            del mask
-            labels = morphology.remove_small_objects(labels, 500,
-                                                     connectivity=2)
-
-            # Saving the outline image
-            image_outline = segmentation.mark_boundaries(img_npy[:, :, :3],
-                                                         labels,
-                                                         color=(0, 1, 0))
-            del img_npy
-            image_outline = (255 * image_outline).astype('uint8')
-            Image.fromarray(image_outline).save(side_fold /
-                                                'Processed_images' /
-                                                image_path.name)
-            del image_outline
-
-            # Calculating the vessels properties and storing them in the Excel
-            label_props = measure.regionprops(labels)
-            del labels
-            for prop in label_props:
-              worksheet.write(index, 0, index)
-              worksheet.write(index, 1, prop.axis_minor_length)
-              worksheet.write(index, 2, prop.area_filled)
-              worksheet.write(index, 3, prop.perimeter)
-              index += 1
-
-            # Ensuring the memory is freed
-            collect()
-
-          # Finally, writing the overall section area
-          worksheet.write(1, 5, overall_area)
-
-      # Any staining that's not the blood vessel detection or S100
-      else:
-
-        # Filling the labels in the data sheet
-        with Workbook(str(side_fold / 'data.xlsx')) as excel:
-          worksheet = excel.add_worksheet()
-          bold = excel.add_format({'bold': True, 'align': 'center'})
-          worksheet.write(0, 0, "Stained area", bold)
-          worksheet.write(1, 0, "Overall area", bold)
-
-          overall_area = 0
-          stained_area = 0
-
-          # Iterating over the subsections for processing
-          for i, image_path in enumerate((side_fold /
-                                          'Raw_images').glob('*.png')):
-            # Updating the progress bar
-            progress.bottom_progress.set(int(100 * i / nb_img))
-            progress.update()
-
-            # Opening the subsection
-            img_npy = np.array(Image.open(image_path))
-
-            # Counting the overall area
-            overall_area += np.count_nonzero(detect_section(img_npy))
-
-            # Processing for the RGB blue channel
-            if choice.get() in ('Alcian blue', 'MSB'):
-              # Improving the contrast on the detection of the staining
-              blue_chan = img_npy[:, :, 0]
-              del img_npy
-              if choice.get() == 'MSB':
-                upper, lower = 233, 79
-              else:
-                upper, lower = 221, 92
-              blue_chan = ((np.clip(blue_chan, lower, upper) - lower) /
-                           (upper - lower) * 255).astype('uint8')
-
-              # Counting the stained area
-              stained = ((blue_chan < 180) * 255).astype('uint8')
-              del blue_chan
-
-            # Processing on the R, G and B channels
-            elif choice.get() == 'MvG':
-              stained = (((img_npy[:, :, 0] < 170) &
-                          (img_npy[:, :, 1] < 170) &
-                          (img_npy[:, :, 2] < 170)) * 255).astype('uint8')
-
-            # For Laminin, processing the Cr channel
-            elif choice.get() == 'Laminin':
-
-              # Opening the subsection in YCbCr color space
-              img = Image.open(image_path)
-              img = img.convert('YCbCr')
-              img_npy = np.array(img)
-              del img
-
-              # Extracting only the channel of interest
-              chan = img_npy[:, :, 2]
-              del img_npy
-
-              # Improving the contrast
-              upper, lower = 145, 130
-              chan = ((np.clip(chan, lower, upper) - lower) /
-                      (upper - lower) * 255).astype('uint8')
-
-              # Extracting the stained area
-              stained = ((chan > 120) * 255).astype('uint8')
-              del chan
-
-            # Counting the stained area
-            stained_area += np.count_nonzero(stained)
-
-            # Marking the detected areas as black for MvG
-            if choice.get() == 'MvG':
-              image_stained = np.stack((255 - stained,
-                                        255 - stained,
-                                        255 - stained), axis=2)
-
-            # Either Laminin or S100, marking the detected area as red
-            elif choice.get() in ('Laminin', 'S100'):
-              image_stained = np.stack(
-                (np.full(stained.shape, 255).astype('uint8'), 255 - stained,
-                 255 - stained), axis=2)
-
-            # Either Alcian blue or MSB, marking the detected area as blue
-            else:
-              image_stained = np.stack(
-                (255 - stained, 255 - stained,
-                 np.full(stained.shape, 255).astype('uint8')), axis=2)
-
-            # Saving the stained areas as an image
-            del stained
-            Image.fromarray(image_stained).save(side_fold /
-                                                'Processed_images' /
-                                                image_path.name)
-
-            # Ensuring the memory is freed
-            collect()
-
-          # Finally, writing the overall and stained areas
-          worksheet.write(0, 1, stained_area)
-          worksheet.write(1, 1, overall_area)
+  else:
+    side_folders = [side_fold for fold in get_section_folders(folder)
+                    for side_fold in get_side_folders(fold)]
+
+  # Creating the progress bar window, or its console counterpart
+  if headless:
+    progress = Progress_console('Processed sections :',
+                                'Processed subsections :')
+  else:
+    progress = Progress_window('Processed sections :',
+                               'Processed subsections :')
+
+  if trace is not None:
+    enable_tracing()
+
+  # Processing all the sections
+  if from_slides:
+    process_slides(chosen_images, choice, progress, workers=workers,
+                   save_raw=save_raw, excel=excel, resume=resume, halo=halo,
+                   memory_budget=memory_budget, min_coverage=min_coverage,
+                   overlay=overlay, mask_downsample=mask_downsample)
+  else:
+    process_side_folders(side_folders, choice, progress, workers, excel,
+                         resume, overlay, mask_downsample)
+
+  # Writing the trace, and displaying the stages that took the longest
+  if trace is not None:
+    save_trace(Path(trace))
+    summary = sorted(summarize().items(), key=lambda item: item[1]['wall_s'],
+                     reverse=True)
+    print(f"Trace written to {trace}")
+    for name, entry in summary[:15]:
+      print(f"{name:<40} {entry['calls']:>6} calls {entry['wall_s']:>9.2f} s "
+            f"{entry['cpu_s']:>9.2f} s CPU {entry['peak_alloc_mb']:>9.1f} MB")
 
   progress.destroy()
-  root.destroy()
+  if not headless:
+    root.destroy()
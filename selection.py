@@ -10,103 +10,194 @@ if hasattr(os, 'add_dll_directory'):
 else:
   from openslide import OpenSlide
 
-from pathlib import Path
 import numpy as np
 import tkinter as tk
-from itertools import product
+from argparse import ArgumentParser
 from sys import exit
-from gc import collect
+from os import cpu_count
 
-from tools import select_folder, get_portion, get_thumbnail, ManualSelection, \
-  Progress_window
+from tools import select_folder, get_thumbnail, ManualSelection, \
+  Progress_window, Progress_console, load_job, load_sections, save_sections, \
+  sections_file_name, extract_sections, find_sections, check_memory_budget
 
 if __name__ == '__main__':
 
-  # Base hidden window, necessary for using the TopLevel
-  root = tk.Tk()
-  root.withdraw()
-
-  # Getting the path to working directory
-  folder = select_folder()
+  # Arguments for running the extraction without any user interaction
+  parser = ArgumentParser(description="Extracts the Left, Center and Right "
+                                      "sections of .ndpi slides. Without any "
+                                      "argument, the folder and the sections "
+                                      "are selected in popup windows.")
+  parser.add_argument('folder', nargs='?', type=Path, default=None,
+                      help="The directory containing the .ndpi files. "
+                           "Setting it enables the headless mode.")
+  parser.add_argument('--sections', type=Path, default=None,
+                      help="The JSON file containing the sections to extract "
+                           "on each slide, or where to save the detected or "
+                           "selected ones. Defaults to the sections key of "
+                           f"the job file, or to {sections_file_name} in the "
+                           "working directory.")
+  parser.add_argument('--job', type=Path, default=None,
+                      help="A JSON job file providing the folder, sections, "
+                           "auto, workers, halo, memory_budget and "
+                           "min_coverage keys. Command-line arguments take "
+                           "precedence.")
+  parser.add_argument('--auto', action='store_true',
+                      help="Detects the sections automatically on each "
+                           "slide. In headless mode they are extracted "
+                           "right away and saved to the sections file, "
+                           "otherwise they are displayed for review in the "
+                           "selection window.")
+  parser.add_argument('--workers', type=int, default=None,
+                      help="The number of worker processes extracting the "
+                           "subsections in parallel, 0 for one per CPU. "
+                           "Defaults to 1, i.e. sequential extraction.")
+  parser.add_argument('--halo', type=int, default=None,
+                      help="The number of pixels by which each subsection "
+                           "overlaps with its neighbours. It should be larger "
+                           "than the largest objects to detect, so that "
+                           "objects crossing the border between subsections "
+                           "are counted once. Defaults to 0.")
+  parser.add_argument('--memory-budget', type=float, default=None,
+                      help="The maximum memory in MB for processing one "
+                           "subsection. If given, each section is cut into "
+                           "as many subsections as needed for fitting in it. "
+                           "Defaults to cutting each section into 4x4 "
+                           "subsections.")
+  parser.add_argument('--min-coverage', type=float, default=None,
+                      help="The minimum fraction of a subsection covered by "
+                           "tissue, as estimated on the slide thumbnail. The "
+                           "subsections below it are not extracted, and "
+                           "processing.py only counts their estimated tissue "
+                           "area. Defaults to 0, i.e. no subsection is "
+                           "skipped.")
+  args = parser.parse_args()
+
+  job = load_job(args.job)
+  folder = args.folder if args.folder is not None else job.get('folder')
+  workers = args.workers if args.workers is not None \
+    else job.get('workers', 1)
+  if workers < 1:
+    workers = cpu_count() or 1
+  halo = args.halo if args.halo is not None else job.get('halo', 0)
+  memory_budget = args.memory_budget if args.memory_budget is not None \
+    else job.get('memory_budget')
+  if memory_budget is not None:
+    memory_budget *= 2 ** 20
+    try:
+      check_memory_budget(memory_budget, halo)
+    except ValueError as error:
+      parser.error(str(error))
+  min_coverage = args.min_coverage if args.min_coverage is not None \
+    else job.get('min_coverage', 0.)
+  auto = args.auto or job.get('auto', False)
+  headless = folder is not None
+
+  if headless:
+    folder = Path(folder)
+    if not folder.is_dir():
+      parser.error(f"The folder {folder} does not exist !")
+
+  else:
+    # Base hidden window, necessary for using the TopLevel
+    root = tk.Tk()
+    root.withdraw()
+
+    # Getting the path to working directory
+    folder = select_folder()
+
+    # In case the user wants to cancel
+    if folder is None:
+      root.destroy()
+      exit()
 
-  # In case the user wants to cancel
-  if folder is None:
     root.destroy()
-    exit()
 
-  root.destroy()
+  # The sections file to read or write, the sections possibly being given
+  # directly in the job file instead
+  sections = args.sections if args.sections is not None \
+    else job.get('sections', folder / sections_file_name)
+  sections_path = sections if not isinstance(sections, dict) \
+    else folder / sections_file_name
 
   # Getting the paths to the .ndpi images
   images = [file for file in folder.iterdir() if file.suffix == '.ndpi']
   chosen_images = {path: [] for path in images}
 
-  # First, iterating through the images to keep only the valid ones
-  for i, img_path in enumerate(images):
-
-    print(f"Now displaying the section : {img_path.stem}")
-
-    slide = OpenSlide(img_path)
-
-    # Getting the thumbnail in a reasonably small size (<4000px)
-    thumb_size, factor_thumb = get_thumbnail(slide, 4000)
-    img = np.array(slide.get_thumbnail((thumb_size, thumb_size)))
+  # In headless mode, the sections are detected automatically
+  if headless and auto:
+    for img_path in images:
 
-    window = ManualSelection(img, img_path.stem)
-    window.mainloop()
-    chosen_images[img_path] = window.selection
+      print(f"Now detecting the sections : {img_path.stem}")
 
-    collect()
+      slide = OpenSlide(img_path)
+      thumb_size, factor_thumb = get_thumbnail(slide, 4000)
+      img = np.array(slide.get_thumbnail((thumb_size, thumb_size)))
+      slide.close()
 
-  nb_tile = 4
-
-  root = tk.Tk()
-  root.withdraw()
-
-  progress_window = Progress_window('NDPI images :',
-                                    'Sections for the current NDPI :')
+      boxes = find_sections(img)
+      if len(boxes) < 3:
+        print(f"Only {len(boxes)} sections found on {img_path.stem}, "
+              f"skipping it")
+        boxes = []
+      chosen_images[img_path] = boxes
 
-  nb_sections = sum((len(img_list) for img_list in chosen_images.values()))
-  section_count = 0
+    # Saving the sections so that they can be reviewed and reused
+    save_sections(sections_path,
+                  {path.stem: boxes for path, boxes in chosen_images.items()})
 
-  # Iterating over all the images
-  for img_path in images:
+  # Otherwise, the sections were selected during a previous run
+  elif headless:
+    try:
+      sections = load_sections(sections)
+    except FileNotFoundError:
+      parser.error(f"No sections file found at {sections} !")
 
-    print(f"Now saving the section : {img_path.stem}")
+    for img_path in images:
+      if img_path.stem not in sections:
+        print(f"No sections given for {img_path.stem}, skipping it")
+      chosen_images[img_path] = sections.get(img_path.stem, [])
 
-    # Opening the image
-    slide = OpenSlide(img_path)
+  # First, iterating through the images to keep only the valid ones
+  else:
+    for i, img_path in enumerate(images):
 
-    # Getting the thumbnail in a reasonably small size (<4000px)
-    _, factor_thumb = get_thumbnail(slide, 4000)
+      print(f"Now displaying the section : {img_path.stem}")
 
-    # Iterating over the selected sections to divide them and save them
-    for j, label in enumerate(chosen_images[img_path]):
+      slide = OpenSlide(img_path)
 
-      # Updating the progress bar
-      progress_window.top_progress.set(int(100 * section_count / nb_sections))
-      progress_window.update()
-      section_count += 1
+      # Getting the thumbnail in a reasonably small size (<4000px)
+      thumb_size, factor_thumb = get_thumbnail(slide, 4000)
+      img = np.array(slide.get_thumbnail((thumb_size, thumb_size)))
+      slide.close()
 
-      nr_to_dir = {0: 'Left', 1: 'Center', 2: 'Right'}
+      # The sections found automatically only need to be reviewed
+      boxes = find_sections(img) if auto else None
+      window = ManualSelection(img, img_path.stem, boxes)
+      window.mainloop()
+      chosen_images[img_path] = window.selection
 
-      # Creating the folder for storing the subsections
-      Path.mkdir(img_path.parent / f'{img_path.stem}' / f'{nr_to_dir[j]}' /
-                 'Raw_images', exist_ok=True, parents=True)
+    # Saving the selection so that the extraction can be run again headless
+    save_sections(sections_path,
+                  {path.stem: boxes for path, boxes in chosen_images.items()})
 
-      # Iterating over each subsection
-      for k, (x, y) in enumerate(product(range(nb_tile), range(nb_tile))):
+  nb_tile = 4
 
-        # Updating the progress bar
-        progress_window.bottom_progress.set(int(100 * k / (nb_tile * nb_tile)))
-        progress_window.update()
+  # Creating the progress bar window, or its console counterpart
+  if headless:
+    progress_window = Progress_console('NDPI images :',
+                                       'Sections for the current NDPI :')
+  else:
+    root = tk.Tk()
+    root.withdraw()
 
-        # Saving the subsection
-        get_portion(slide, label, factor_thumb, 4, x, y).save(
-          img_path.parent / f'{img_path.stem}' / f'{nr_to_dir[j]}' /
-          'Raw_images' / f'Section_{x + 1}_{y + 1}.png')
+    progress_window = Progress_window('NDPI images :',
+                                      'Sections for the current NDPI :')
 
-        # Ensuring the memory is freed
-        collect()
+  # Extracting and saving all the subsections
+  extract_sections(chosen_images, progress_window, nb_tile, workers,
+                   halo=halo, memory_budget=memory_budget,
+                   min_coverage=min_coverage)
 
   progress_window.destroy()
-  root.destroy()
+  if not headless:
+    root.destroy()
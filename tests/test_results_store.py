@@ -0,0 +1,40 @@
+# coding: utf-8
+
+import numpy as np
+
+from tools import write_results, read_results, read_areas, \
+  write_data_files
+from tools.section_processing import object_columns, position_columns
+
+
+def test_empty_results(tmp_path):
+  """A side folder without any subsection gets all the object columns, empty,
+  and its areas can be read back."""
+
+  path = tmp_path / 'data.npz'
+  write_results(path, 'Blood vessels', 'slide', 'Left', [], [], [], [],
+                (*object_columns, *position_columns))
+
+  results = read_results(path)
+  for prop in (*object_columns, *position_columns):
+    assert results[prop].shape == (0,)
+    assert results[prop].dtype == np.float64
+  assert results['overall_area'] == 0
+
+  areas, overall_area = read_areas(path)
+  assert areas.shape == (0,)
+  assert overall_area == 0
+
+
+def test_empty_data_files(tmp_path):
+  """The data files written for a side folder without any subsection can be
+  read back, from both the .npz and the .xlsx file."""
+
+  side_fold = tmp_path / 'slide' / 'Left'
+  side_fold.mkdir(parents=True)
+  write_data_files(side_fold, 'Blood vessels', [])
+
+  for name in ('data.npz', 'data.xlsx'):
+    areas, overall_area = read_areas(side_fold / name)
+    assert areas.shape == (0,)
+    assert overall_area == 0
@@ -1,10 +1,42 @@
 # coding: utf-8
 
-from .progress_window import Progress_window
+from .progress_window import Progress_window, Progress_console
+from .trace import enable_tracing, disable_tracing, tracing_enabled, stage, \
+  traced, trace_tile, save_trace, summarize
 from .folder_selection import select_folder
-from .detect_section import detect_section, detect_section_s100
+from .detect_section import detect_section, detect_section_s100, \
+  find_sections, section_area, section_mask_accuracy, shrink
 from .image_choice import Image_choice_window
-from .slide_tools import get_thumbnail, get_image, get_portion
-from .processing_tools import process_vessels
-from .processing_choice import Processing_choice
-from .manual_selection import ManualSelection
+from .slide_tools import get_thumbnail, get_image, get_portion, \
+  get_portion_coordinates
+from .tile import Tile
+from .contrast import histogram, percentiles, stretch_lut, clip_stretch_lut, \
+  threshold_lut, mask_lut, apply_lut
+from .processing_tools import process_vessels, detect_vessels, \
+  filter_labels, select_labels, fill_holed_objects
+from .pipeline import Channel, Invert, Stretch, AutoStretch, Threshold, \
+  Morphology, Apply, All, run_pipeline
+from .stains import Stain, stains
+from .processing_choice import Processing_choice, processing_types
+from .manual_selection import ManualSelection, Box
+from .section_extraction import extract_sections, save_portion, \
+  close_slides
+from .section_processing import process_image, process_tile, \
+  process_region, process_side_folders, process_slides, write_data_sheet, \
+  write_data_files, get_section_folders, get_side_folders, TileResult
+from .results_store import write_results, read_results, load_results, \
+  find_data_files, read_areas, load_areas, load_folder_areas, \
+  results_file_name
+from .job_file import load_job, load_sections, save_sections, \
+  sections_file_name
+from .manifest import load_manifest, append_manifest, save_manifest, \
+  manifest_file_name
+from .synthetic import synthetic_tile, FakeSlide
+from .tiling import TileFrame, get_tiling, get_tile_grid, load_tiling, \
+  save_tiling, get_frame, tiling_file_name, check_memory_budget
+from .buffers import BufferPool, buffer_pool
+from .overlay_writer import OverlayOptions, OverlayWriter, overlay_codecs, \
+  save_overlay, write_overlay, start_writer, wait_writer, stop_writer
+from .outline import find_boundaries, outline_objects
+from .pyramid import write_pyramid, write_side_pyramids, pyramid_tile_size
+from .morphology import apply_morphology
@@ -0,0 +1,77 @@
+# coding: utf-8
+
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+
+class BufferPool:
+  """Keeps the full-size arrays released by the processing of a subsection,
+  so that the next subsections reuse them instead of allocating new ones.
+
+  Only arrays owning their memory are kept, never views on other arrays, and
+  only for the shapes and dtypes that were already requested, so that the pool
+  never holds arrays nobody would reuse. An array must only be released once
+  it isn't used anymore, by the code that got it or created it. The pool can
+  be shared with background threads.
+  """
+
+  def __init__(self, max_per_key: int = 4) -> None:
+    """Sets the args.
+
+    Args:
+      max_per_key: The maximum number of arrays kept for each shape and dtype.
+    """
+
+    self._max_per_key = max_per_key
+    self._lock = threading.Lock()
+    self._free: Dict[Tuple[Tuple[int, ...], np.dtype],
+                     List[np.ndarray]] = dict()
+
+  def get(self,
+          shape: Tuple[int, ...],
+          dtype=np.uint8) -> np.ndarray:
+    """Returns an uninitialized array, reusing a released one if possible.
+
+    Args:
+      shape: The shape of the array.
+      dtype: The dtype of the array.
+
+    Returns:
+      The array, whose content is undefined.
+    """
+
+    with self._lock:
+      free = self._free.setdefault((tuple(shape), np.dtype(dtype)), list())
+      if free:
+        return free.pop()
+    return np.empty(shape, dtype=dtype)
+
+  def release(self, *arrays: Optional[np.ndarray]) -> None:
+    """Gives arrays back to the pool, for reusing them later.
+
+    Args:
+      *arrays: The arrays not used anymore. The None values, the arrays not
+        owning their memory, and the ones of a shape and dtype never
+        requested, are ignored.
+    """
+
+    for array in arrays:
+      if array is None or not array.flags.owndata \
+          or not array.flags.c_contiguous:
+        continue
+      with self._lock:
+        free = self._free.get((array.shape, array.dtype))
+        if free is not None and len(free) < self._max_per_key \
+            and not any(array is other for other in free):
+          free.append(array)
+
+  def clear(self) -> None:
+    """Frees all the arrays held by the pool."""
+
+    with self._lock:
+      self._free.clear()
+
+
+# The buffer pool of the current process
+buffer_pool = BufferPool()
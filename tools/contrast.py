@@ -0,0 +1,164 @@
+# coding: utf-8
+
+import numpy as np
+from typing import Optional, Tuple
+
+# The number of pixels counted at once when building a histogram, so that
+# the temporary integer copy of the channel stays small
+_chunk_size = 1 << 20
+
+# The value of each pixel of an uint8 channel, for building the lookup tables
+_values = np.arange(256, dtype=np.uint8)
+
+
+def histogram(channel: np.ndarray) -> np.ndarray:
+  """Counts the occurrences of each value in an uint8 channel.
+
+  Args:
+    channel: The uint8 channel, of any shape and layout.
+
+  Returns:
+    An array of 256 counts, indexed by pixel value.
+  """
+
+  hist = np.zeros(256, dtype=np.int64)
+  rows = channel.reshape(-1, channel.shape[-1]) if channel.ndim > 1 \
+    else channel.reshape(1, -1)
+  step = max(1, _chunk_size // max(1, rows.shape[1]))
+  for start in range(0, rows.shape[0], step):
+    hist += np.bincount(rows[start:start + step].ravel(), minlength=256)
+  return hist
+
+
+def percentiles(hist: np.ndarray, *q: float) -> Tuple[float, ...]:
+  """Computes percentiles of an uint8 channel from its histogram.
+
+  The results are identical to those of :func:`numpy.percentile` with its
+  default linear interpolation, but only take a pass over the 256 bins
+  instead of partitioning all the pixels.
+
+  Args:
+    hist: The histogram of the channel, as returned by :func:`histogram`.
+    *q: The percentiles to compute, between 0 and 100.
+
+  Returns:
+    The value of each requested percentile.
+  """
+
+  cumulated = np.cumsum(hist)
+  count = int(cumulated[-1])
+
+  def sorted_value(index: int) -> int:
+    """Returns the value at the given index of the sorted pixels."""
+
+    return int(np.searchsorted(cumulated, index, side='right'))
+
+  values = list()
+  for quantile in q:
+    # Reproducing the computation of numpy.percentile
+    virtual = (count - 1) * np.true_divide(quantile, 100)
+    previous = int(np.floor(virtual))
+    if virtual >= count - 1:
+      values.append(np.float64(sorted_value(count - 1)))
+      continue
+
+    gamma = virtual - previous
+    low, high = sorted_value(previous), sorted_value(previous + 1)
+    diff = high - low
+    values.append(np.float64(high - diff * (1 - gamma)) if gamma >= 0.5
+                  else np.float64(low + diff * gamma))
+
+  return tuple(values)
+
+
+def stretch_lut(lower: float, upper: float) -> np.ndarray:
+  """Builds the lookup table stretching the contrast of an uint8 channel.
+
+  Applying it gives the same result as
+  ``np.clip((channel - lower) / (upper - lower) * 255, 0, 255)
+  .astype('uint8')``.
+
+  Args:
+    lower: The value mapped to 0.
+    upper: The value mapped to 255.
+
+  Returns:
+    The uint8 lookup table, indexed by pixel value.
+  """
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return np.clip((_values - lower) / (upper - lower) * 255, 0,
+                   255).astype('uint8')
+
+
+def clip_stretch_lut(lower: int, upper: int) -> np.ndarray:
+  """Builds the lookup table clipping an uint8 channel between two fixed
+  values and stretching it to the full range.
+
+  Applying it gives the same result as
+  ``((np.clip(channel, lower, upper) - lower) / (upper - lower) * 255)
+  .astype('uint8')``.
+
+  Args:
+    lower: The value mapped to 0.
+    upper: The value mapped to 255.
+
+  Returns:
+    The uint8 lookup table, indexed by pixel value.
+  """
+
+  return ((np.clip(_values, lower, upper) - lower) / (upper - lower) *
+          255).astype('uint8')
+
+
+def threshold_lut(lut: np.ndarray,
+                  low: int = 0,
+                  high: int = 255) -> np.ndarray:
+  """Fuses a thresholding step into a lookup table.
+
+  Args:
+    lut: The uint8 lookup table applied before thresholding.
+    low: The lowest value kept after applying lut, included.
+    high: The highest value kept after applying lut, included.
+
+  Returns:
+    A boolean lookup table, True for the pixel values kept after applying lut
+    and thresholding.
+  """
+
+  return (lut >= low) & (lut <= high)
+
+
+def apply_lut(channel: np.ndarray,
+              lut: np.ndarray,
+              out: Optional[np.ndarray] = None) -> np.ndarray:
+  """Applies a lookup table to an uint8 channel, in a single pass.
+
+  Args:
+    channel: The uint8 channel to transform.
+    lut: The lookup table, with one entry per pixel value, or with one row of
+      entries per pixel value for giving several channels at once.
+    out: An array where to write the result, of the shape of the channel
+      followed by the one of a row of the lookup table, and of its dtype.
+
+  Returns:
+    The transformed channel, of the dtype of the lookup table.
+  """
+
+  # The indexes can't be out of bounds, clipping lets numpy write directly
+  # into out instead of going through a temporary
+  return np.take(lut, channel, axis=0, out=out, mode='clip')
+
+
+def mask_lut(lut: np.ndarray, value: int = 255) -> np.ndarray:
+  """Converts a boolean lookup table into one giving an uint8 mask.
+
+  Args:
+    lut: The boolean lookup table.
+    value: The value of the selected pixels in the mask.
+
+  Returns:
+    The uint8 lookup table, value for the selected pixels and 0 elsewhere.
+  """
+
+  return (lut * value).astype('uint8')
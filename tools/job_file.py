@@ -0,0 +1,98 @@
+# coding: utf-8
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from .manual_selection import Box
+
+# The default name of the file storing the selected sections of a folder
+sections_file_name = 'sections.json'
+
+
+def load_job(path: Optional[Path]) -> dict:
+  """Reads a job file describing a non-interactive run.
+
+  The job file is a JSON object whose keys mirror the command-line arguments
+  of the scripts, the hyphens being replaced with underscores. The
+  command-line arguments take precedence over the job file. The keys read by
+  both processing.py and selection.py are:
+
+  * ``folder``: the working directory, containing the .ndpi files.
+  * ``sections``: either a path to a sections file, or the sections
+    themselves in the same format as :func:`save_sections`. selection.py
+    writes the sections it detects or that are selected to this path, if it
+    is one.
+  * ``workers``: the number of worker processes, 0 for one per CPU.
+  * ``halo``, ``memory_budget`` and ``min_coverage``: how the sections are
+    cut into subsections, the memory budget being in MB.
+
+  The keys only read by processing.py are ``stain`` (one of
+  processing_types), ``from_slides``, ``save_raw``, ``no_excel``,
+  ``restart``, ``trace`` (the path to the trace file to write), ``overlay``
+  (the codec of the processed images, or 'none'), ``overlay_level``,
+  ``overlay_downsample``, ``pyramid``, ``pyramid_raw`` and
+  ``mask_downsample``. The key only read by selection.py is ``auto``. See the
+  help of the scripts for the meaning of each one.
+
+  The relative paths given for ``folder``, ``sections`` and ``trace`` are
+  relative to the job file itself.
+
+  Args:
+    path: The path to the job file, or None if no job file was given.
+
+  Returns:
+    The content of the job file, or an empty dict if no file was given.
+  """
+
+  if path is None:
+    return dict()
+
+  with open(path, 'r') as file:
+    job = json.load(file)
+
+  if not isinstance(job, dict):
+    raise ValueError(f"The job file {path} should contain a JSON object !")
+
+  # Paths given in the job file are relative to the job file itself
+  for key in ('folder', 'sections', 'trace'):
+    if isinstance(job.get(key), str):
+      job[key] = Path(path).parent / job[key]
+
+  return job
+
+
+def save_sections(path: Path, sections: Dict[str, List[Box]]) -> None:
+  """Saves the sections selected on each slide to a JSON file, so that they
+  can be reused for a non-interactive run.
+
+  Args:
+    path: The path to the JSON file to write.
+    sections: For each slide name, the list of the Left, Center and Right
+      boxes.
+  """
+
+  with open(path, 'w') as file:
+    json.dump({name: [list(map(int, box.bbox)) for box in boxes]
+               for name, boxes in sections.items()}, file, indent=2)
+
+
+def load_sections(sections: Union[Path, dict]) -> Dict[str, List[Box]]:
+  """Reads the sections to extract on each slide.
+
+  Args:
+    sections: Either the path to a JSON file written by
+      :func:`save_sections`, or its already loaded content. It maps each slide
+      name (without extension) to a list of ``[min_y, min_x, max_y, max_x]``
+      boxes, in the coordinates of the slide thumbnail.
+
+  Returns:
+    For each slide name, the list of the Left, Center and Right boxes.
+  """
+
+  if not isinstance(sections, dict):
+    with open(sections, 'r') as file:
+      sections = json.load(file)
+
+  return {name: [Box(tuple(int(val) for val in bbox)) for bbox in boxes]
+          for name, boxes in sections.items()}
@@ -0,0 +1,115 @@
+# coding: utf-8
+
+import json
+import os
+from hashlib import blake2b
+from pathlib import Path
+from typing import Dict
+
+# The name of the file recording the processed subsections of a side folder
+manifest_file_name = 'manifest.jsonl'
+
+
+def hash_file(path: Path) -> str:
+  """Computes a hash of the content of a file.
+
+  Args:
+    path: The path to the file to hash.
+
+  Returns:
+    The hexadecimal digest of the file content.
+  """
+
+  digest = blake2b(digest_size=16)
+  with open(path, 'rb') as file:
+    for chunk in iter(lambda: file.read(1 << 20), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def hash_region(slide_path: Path, *params) -> str:
+  """Computes a hash identifying a region read from a slide.
+
+  The slide itself is identified by its name, size and modification time, so
+  that it doesn't need to be read entirely.
+
+  Args:
+    slide_path: The path to the slide.
+    *params: All the parameters defining the region to read.
+
+  Returns:
+    The hexadecimal digest identifying the region.
+  """
+
+  stat = slide_path.stat()
+  return blake2b(repr((slide_path.name, stat.st_size, stat.st_mtime_ns,
+                       *params)).encode(), digest_size=16).hexdigest()
+
+
+def load_manifest(side_fold: Path) -> Dict[str, dict]:
+  """Reads the manifest of a side folder.
+
+  The manifest holds one JSON line per processed subsection, a later line
+  replacing the earlier ones of the same subsection. The lines that cannot be
+  read, e.g. one left incomplete by an interrupted run, are ignored.
+
+  Args:
+    side_fold: The side folder whose manifest to read.
+
+  Returns:
+    For each already processed subsection, its manifest entry. Empty if the
+    folder has no manifest or if it cannot be read.
+  """
+
+  manifest = dict()
+  try:
+    with open(side_fold / manifest_file_name, 'r') as file:
+      for line in file:
+        try:
+          record = json.loads(line)
+        except ValueError:
+          continue
+        if isinstance(record, dict) and isinstance(record.get('entry'),
+                                                   dict):
+          manifest[str(record.get('name'))] = record['entry']
+  except OSError:
+    return dict()
+
+  return manifest
+
+
+def append_manifest(side_fold: Path, name: str, entry: dict) -> None:
+  """Records the entry of a single subsection at the end of the manifest of
+  its side folder.
+
+  Only the new entry is written, so that recording each subsection costs the
+  same regardless of how many were processed before.
+
+  Args:
+    side_fold: The side folder of the subsection.
+    name: The name of the subsection, without extension.
+    entry: The manifest entry of the subsection.
+  """
+
+  with open(side_fold / manifest_file_name, 'a') as file:
+    file.write(json.dumps({'name': name, 'entry': entry}) + '\n')
+
+
+def save_manifest(side_fold: Path, manifest: Dict[str, dict]) -> None:
+  """Writes the whole manifest of a side folder, with a single line per
+  subsection.
+
+  The manifest is first written to a temporary file that then replaces the
+  previous one, so that an interrupted run never leaves a corrupted manifest.
+
+  Args:
+    side_fold: The side folder whose manifest to write.
+    manifest: For each processed subsection, its manifest entry.
+  """
+
+  path = side_fold / manifest_file_name
+  tmp_path = path.with_name(path.name + '.tmp')
+  with open(tmp_path, 'w') as file:
+    for name, entry in manifest.items():
+      file.write(json.dumps({'name': name, 'entry': entry}) + '\n')
+  os.replace(tmp_path, path)
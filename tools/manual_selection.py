@@ -19,7 +19,10 @@ class Box:
 class ManualSelection(tk.Tk):
   """"""
 
-  def __init__(self, thumbnail: np.ndarray, name: str) -> None:
+  def __init__(self,
+               thumbnail: np.ndarray,
+               name: str,
+               boxes: Optional[List[Box]] = None) -> None:
     """"""
 
     super().__init__()
@@ -31,6 +34,7 @@ class ManualSelection(tk.Tk):
     self.selection = list()
 
     self._rectangles: List[Optional[int]] = [None, None, None]
+    self._drawing: Optional[int] = None
     self._current = 0
     self._start = (0., 0.)
 
@@ -43,6 +47,11 @@ class ManualSelection(tk.Tk):
     self._set_layout()
     self._set_bindings()
 
+    # Displaying the sections found automatically, for review
+    self._review = bool(boxes) and len(boxes) == 3
+    if self._review:
+      self._draw_boxes(boxes)
+
     self.update()
     self.protocol("WM_DELETE_WINDOW", self._save_and_exit)
 
@@ -92,6 +101,17 @@ class ManualSelection(tk.Tk):
     self._next_button.pack(fill="x", anchor="n", side='top', padx=10,
                            pady=5, expand=False)
 
+  def _draw_boxes(self, boxes: List[Box]) -> None:
+    """Draws already known sections, that can either be kept by closing the
+    window, or replaced one after the other by drawing new ones."""
+
+    scale = self._image_tk.width() / self._img.shape[1]
+    for i, box in enumerate(boxes):
+      y0, x0, y1, x1 = box.bbox
+      self._rectangles[i] = self._img_canvas.create_rectangle(
+        (x0 * scale, y0 * scale, x1 * scale, y1 * scale))
+      self._label_vars[i].set(self._label_vars[i].get().replace('X', 'auto'))
+
   def _set_bindings(self) -> None:
     """"""
 
@@ -100,16 +120,14 @@ class ManualSelection(tk.Tk):
     self._img_canvas.bind('<ButtonRelease-1>', self._stop_box)
 
   def _start_box(self, event: tk.Event) -> None:
-    """"""
+    """Starts drawing a new box, the current one being kept until the new
+    one is complete."""
 
     if self._current > 2:
       return
 
-    if self._rectangles[self._current] is not None:
-      self._img_canvas.delete(self._rectangles[self._current])
-      self._rectangles[self._current] = None
-
     self._start = (event.x, event.y)
+    self._drawing = None
 
   def _extend_box(self, event: tk.Event) -> None:
     """"""
@@ -117,22 +135,31 @@ class ManualSelection(tk.Tk):
     if self._current > 2:
       return
 
-    if self._rectangles[self._current] is None:
-     self._rectangles[self._current] = self._img_canvas.create_rectangle(
-       (self._start[0], self._start[1], event.x, event.y))
+    if self._drawing is None:
+      self._drawing = self._img_canvas.create_rectangle(
+        (self._start[0], self._start[1], event.x, event.y))
 
     else:
-      self._img_canvas.coords(self._rectangles[self._current],
-                              self._start[0], self._start[1], event.x, event.y)
+      self._img_canvas.coords(self._drawing, self._start[0], self._start[1],
+                              event.x, event.y)
 
   def _stop_box(self, event: tk.Event) -> None:
-    """"""
+    """Replaces the current box with the one just drawn, unless the mouse
+    was only clicked or the new box is empty."""
 
-    if self._current > 2:
+    if self._current > 2 or self._drawing is None:
       return
 
-    self._img_canvas.coords(self._rectangles[self._current],
-                            self._start[0], self._start[1], event.x, event.y)
+    drawing, self._drawing = self._drawing, None
+    if event.x == self._start[0] or event.y == self._start[1]:
+      self._img_canvas.delete(drawing)
+      return
+
+    self._img_canvas.coords(drawing, self._start[0], self._start[1],
+                            event.x, event.y)
+    if self._rectangles[self._current] is not None:
+      self._img_canvas.delete(self._rectangles[self._current])
+    self._rectangles[self._current] = drawing
 
   def _next_clicked(self) -> None:
     """"""
@@ -140,9 +167,11 @@ class ManualSelection(tk.Tk):
     if self._rectangles[self._current] is None:
       messagebox.showerror("Error !", "Please select a section before "
                                       "switching to the next column.")
+      return
 
     self._label_vars[self._current].set(
-      self._label_vars[self._current].get().replace('X', 'OK'))
+      self._label_vars[self._current].get().replace(
+        'X', 'OK').replace('auto', 'OK'))
     self._current += 1
 
     if self._current > 2:
@@ -151,7 +180,7 @@ class ManualSelection(tk.Tk):
   def _save_and_exit(self) -> None:
     """"""
 
-    if self._current < 3:
+    if self._current < 3 and not self._review:
       messagebox.showerror("Error !", "Please select all the sections before "
                                       "exiting.")
       return
@@ -0,0 +1,167 @@
+# coding: utf-8
+
+import numpy as np
+from typing import Optional
+import cv2
+
+# The number of pixels packed in each word of a binary mask
+_word_bits = 64
+
+# The erosions and dilations each morphological operation is made of
+_steps = {cv2.MORPH_DILATE: (cv2.MORPH_DILATE,),
+          cv2.MORPH_ERODE: (cv2.MORPH_ERODE,),
+          cv2.MORPH_OPEN: (cv2.MORPH_ERODE, cv2.MORPH_DILATE),
+          cv2.MORPH_CLOSE: (cv2.MORPH_DILATE, cv2.MORPH_ERODE)}
+
+# The smallest kernels for which the packed masks are faster than OpenCV, for
+# a single erosion or dilation and for an opening or a closing. The packing and
+# unpacking cost about as much as two small OpenCV passes
+_min_packed_size = (24, 16)
+
+
+def _pack(mask: np.ndarray) -> np.ndarray:
+  """Packs each row of a mask into 64-bit words, the first pixel of a word
+  being its most significant bit and the padding bits being 0.
+
+  The words are returned transposed, i.e. indexed by word and then by row, so
+  that the passes along both axes work on long contiguous runs.
+  """
+
+  height, width = mask.shape
+  packed = np.packbits(mask, axis=1)
+  n_bytes = -(-width // _word_bits) * 8
+  if packed.shape[1] != n_bytes:
+    padded = np.zeros((height, n_bytes), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    packed = padded
+  return packed.view('>u8').T.astype(np.uint64, order='C')
+
+
+def _unpack(words: np.ndarray,
+            width: int,
+            out: Optional[np.ndarray] = None) -> np.ndarray:
+  """Unpacks words packed by :func:`_pack` into a mask, 255 for the set bits
+  and 0 elsewhere."""
+
+  packed = words.T.astype('>u8', order='C').view(np.uint8)
+  bits = np.unpackbits(packed, axis=1, count=width)
+  return np.negative(bits, out=bits if out is None else out)
+
+
+def _clear_padding(words: np.ndarray, width: int) -> np.ndarray:
+  """Sets to 0 the bits of the last word of each row lying beyond the
+  width."""
+
+  rest = width % _word_bits
+  if rest:
+    words[-1] &= np.uint64(((1 << rest) - 1) << (_word_bits - rest))
+  return words
+
+
+def _shift_columns(words: np.ndarray, shift: int) -> np.ndarray:
+  """Returns the packed mask whose pixel at each column is the one at the
+  column plus shift, the pixels coming from outside being 0."""
+
+  n_words = words.shape[0]
+  shifted = np.zeros_like(words)
+  offset, bits = divmod(abs(shift), _word_bits)
+  if offset >= n_words:
+    return shifted
+
+  # The bits move towards the most significant ones for positive shifts
+  if shift >= 0:
+    np.left_shift(words[offset:], np.uint64(bits),
+                  out=shifted[:n_words - offset])
+    if bits:
+      shifted[:n_words - offset - 1] |= \
+        words[offset + 1:] >> np.uint64(_word_bits - bits)
+  else:
+    np.right_shift(words[:n_words - offset], np.uint64(bits),
+                   out=shifted[offset:])
+    if bits:
+      shifted[offset + 1:] |= \
+        words[:n_words - offset - 1] << np.uint64(_word_bits - bits)
+  return shifted
+
+
+def _dilate(words: np.ndarray, size: int, width: int) -> np.ndarray:
+  """Dilates a packed mask with a size x size square kernel anchored at its
+  center, like OpenCV does.
+
+  The maximum over a window of 2n pixels is the maximum over two overlapping
+  windows of n pixels, so a window of any size is obtained in a logarithmic
+  number of passes along each axis.
+  """
+
+  n_words, height = words.shape
+  anchor = size // 2
+
+  # Along the y-axis, padding with empty rows so that each window starts at
+  # its first row
+  padded = np.zeros((n_words, height + size - 1), dtype=np.uint64)
+  padded[:, anchor: anchor + height] = words
+  span = 1
+  while 2 * span <= size:
+    padded[:, :-span] |= padded[:, span:]
+    span *= 2
+  if size > span:
+    padded[:, :-(size - span)] |= padded[:, size - span:]
+  words = padded[:, :height]
+
+  # Along the x-axis, padding with whole empty words for the same purpose
+  offset = -(-anchor // _word_bits)
+  padded = np.zeros((n_words + offset, height), dtype=np.uint64)
+  padded[offset:] = words
+  span = 1
+  while 2 * span <= size:
+    padded |= _shift_columns(padded, span)
+    span *= 2
+  if size > span:
+    padded |= _shift_columns(padded, size - span)
+  words = _shift_columns(padded, -anchor)[offset:]
+
+  return _clear_padding(words, width)
+
+
+def apply_morphology(mask: np.ndarray,
+                     operation: int,
+                     size: int,
+                     out: Optional[np.ndarray] = None,
+                     binary: bool = False) -> np.ndarray:
+  """Applies a morphological operation with a size x size square kernel,
+  giving exactly the same result as :func:`cv2.morphologyEx` with
+  np.ones((size, size)).
+
+  If the mask is known to only contain 0 and 255 and the kernel is large, the
+  erosions and dilations are performed on its rows packed into 64-bit words.
+  The cost of OpenCV's separable implementation grows linearly with the size
+  of the kernel, whereas here it grows logarithmically and each operation
+  handles 64 pixels at once. Otherwise, OpenCV is used.
+
+  Args:
+    mask: The uint8 image to process.
+    operation: The OpenCV morphological operation, e.g. cv2.MORPH_CLOSE.
+    size: The side of the square kernel, in pixels.
+    out: The array where to write the result, if given.
+    binary: Whether the image only contains 0 and 255.
+
+  Returns:
+    The processed image.
+  """
+
+  steps = _steps.get(operation, ())
+  if not binary or not steps \
+      or size < _min_packed_size[len(steps) - 1]:
+    return cv2.morphologyEx(mask, operation, np.ones((size, size)), dst=out)
+
+  # An erosion is a dilation of the background
+  width = mask.shape[1]
+  words = _pack(mask)
+  for step in steps:
+    if step == cv2.MORPH_ERODE:
+      words = _clear_padding(np.invert(words, out=words), width)
+    words = _dilate(words, size, width)
+    if step == cv2.MORPH_ERODE:
+      words = _clear_padding(np.invert(words, out=words), width)
+
+  return _unpack(words, width, out)
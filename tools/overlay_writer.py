@@ -0,0 +1,246 @@
+# coding: utf-8
+
+import threading
+from queue import Queue
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from PIL import Image
+import cv2
+
+from .trace import stage
+from .buffers import buffer_pool
+
+# The codecs the processed images can be written with, and their extension
+overlay_codecs = {'png': '.png', 'bmp': '.bmp', 'tiff': '.tif'}
+
+
+@dataclass(frozen=True)
+class OverlayOptions:
+  """How the processed images are written to the Processed_images folders.
+
+  The png codec compresses the images with the given level, from 0 for no
+  compression to 9, the default one being Pillow's. The bmp and tiff codecs
+  write the pixels uncompressed, which is the fastest but takes the most disk
+  space. If the codec is None, no processed image is written at all.
+
+  The images are shrunk by the downsample factor along both axes before
+  being written.
+
+  Once a side folder is processed, its processed images can also be
+  assembled into a single pyramidal TIFF image if pyramid is set, and so can
+  its raw images if pyramid_raw is set. The level then also applies to the
+  compression of the TIFF tiles.
+  """
+
+  codec: Optional[str] = 'png'
+  level: Optional[int] = None
+  downsample: int = 1
+  pyramid: bool = False
+  pyramid_raw: bool = False
+
+  def __post_init__(self) -> None:
+    if self.codec is not None and self.codec not in overlay_codecs:
+      raise ValueError(f"Unknown codec for the processed images : "
+                       f"{self.codec}")
+    if self.level is not None and not 0 <= self.level <= 9:
+      raise ValueError(f"The compression level should be between 0 and 9, "
+                       f"got {self.level}")
+    if self.downsample < 1:
+      raise ValueError(f"The downsample factor should be at least 1, got "
+                       f"{self.downsample}")
+    if self.pyramid and self.codec is None:
+      raise ValueError("The processed images can't be assembled into a "
+                       "pyramidal image if they are not written")
+
+  @property
+  def enabled(self) -> bool:
+    """Whether the processed images are written."""
+
+    return self.codec is not None
+
+  @property
+  def signature(self) -> Optional[dict]:
+    """The options the written images depend on, as recorded in the
+    manifest, or None if no image is written."""
+
+    if not self.enabled:
+      return None
+    return {'codec': self.codec, 'level': self.level,
+            'downsample': self.downsample}
+
+  def path(self, folder: Path, name: str) -> Path:
+    """Returns the path of the processed image of a subsection.
+
+    Args:
+      folder: The Processed_images folder of the side folder.
+      name: The name of the subsection, without extension.
+    """
+
+    return folder / f'{name}{overlay_codecs[self.codec]}'
+
+
+def save_overlay(image: np.ndarray,
+                 path: Path,
+                 options: OverlayOptions) -> None:
+  """Downsamples a processed image if requested, and writes it to the disk
+  with the chosen codec.
+
+  Args:
+    image: The processed image to write.
+    path: The path where to write it.
+    options: How to write the image.
+  """
+
+  if options.downsample > 1:
+    height, width = image.shape[:2]
+    with stage('overlay downsample', tile=path.stem):
+      image = cv2.resize(image, (max(1, width // options.downsample),
+                                 max(1, height // options.downsample)),
+                         interpolation=cv2.INTER_AREA)
+
+  params = dict()
+  if options.codec == 'png' and options.level is not None:
+    params['compress_level'] = options.level
+
+  with stage(f'{options.codec} encode', tile=path.stem):
+    Image.fromarray(image).save(path, **params)
+
+
+class OverlayWriter:
+  """Writes the processed images in a background thread, so that the
+  processing of the next subsections doesn't wait for the encoding.
+
+  At most max_queue images wait for being written, and submitting blocks
+  while the queue is full so that the memory usage stays bounded. An error
+  raised while writing is raised again by the next call to submit or close.
+  """
+
+  def __init__(self, max_queue: int = 4) -> None:
+    """Sets the args and starts the thread.
+
+    Args:
+      max_queue: The maximum number of images waiting for being written.
+    """
+
+    self._queue = Queue(maxsize=max_queue)
+    self._error: Optional[BaseException] = None
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def submit(self,
+             image: np.ndarray,
+             path: Path,
+             options: OverlayOptions) -> None:
+    """Queues an image for writing, and gives it back to the buffer pool once
+    written.
+
+    Args:
+      image: The processed image to write, not to be modified afterwards.
+      path: The path where to write it.
+      options: How to write the image.
+    """
+
+    self._raise()
+    self._queue.put((image, path, options))
+
+  def wait(self) -> None:
+    """Waits for all the queued images to be written, the thread then
+    waiting for the next ones."""
+
+    self._queue.join()
+    self._raise()
+
+  def close(self) -> None:
+    """Waits for all the queued images to be written, and stops the
+    thread."""
+
+    self._queue.put(None)
+    self._thread.join()
+    self._raise()
+
+  def _run(self) -> None:
+    """Writes the queued images until close is called."""
+
+    while True:
+      item = self._queue.get()
+      if item is None:
+        self._queue.task_done()
+        return
+      image, path, options = item
+
+      # The remaining images are dropped after an error
+      try:
+        if self._error is None:
+          save_overlay(image, path, options)
+      except BaseException as error:
+        self._error = error
+      buffer_pool.release(image)
+      del image, item
+      self._queue.task_done()
+
+  def _raise(self) -> None:
+    """Raises the error that occurred in the thread, if any."""
+
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+
+
+# The background writer of the current process, None when writing
+# synchronously
+_writer: Optional[OverlayWriter] = None
+
+
+def start_writer(max_queue: int = 4) -> None:
+  """Writes the processed images of the current process in a background
+  thread from now on.
+
+  Args:
+    max_queue: The maximum number of images waiting for being written.
+  """
+
+  global _writer
+  if _writer is None:
+    _writer = OverlayWriter(max_queue)
+
+
+def wait_writer() -> None:
+  """Waits for the background writer, if any, to write all the images
+  submitted so far."""
+
+  if _writer is not None:
+    _writer.wait()
+
+
+def stop_writer() -> None:
+  """Waits for the background writer to write all its images and stops it,
+  the next images being written synchronously."""
+
+  global _writer
+  writer, _writer = _writer, None
+  if writer is not None:
+    writer.close()
+
+
+def write_overlay(image: Optional[np.ndarray],
+                  path: Path,
+                  options: OverlayOptions) -> None:
+  """Writes a processed image, in the background if a writer was started in
+  the current process, and gives it back to the buffer pool once written.
+
+  Args:
+    image: The processed image to write, not to be used anymore by the caller.
+      Nothing is written if it is None or if the writing is disabled.
+    path: The path where to write it.
+    options: How to write the image.
+  """
+
+  if image is None or not options.enabled:
+    buffer_pool.release(image)
+  elif _writer is not None:
+    _writer.submit(image, path, options)
+  else:
+    save_overlay(image, path, options)
+    buffer_pool.release(image)
@@ -0,0 +1,256 @@
+# coding: utf-8
+
+import numpy as np
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple, Union
+import cv2
+
+from .tile import Tile
+from .trace import stage
+from .buffers import buffer_pool
+from .morphology import apply_morphology
+from .contrast import histogram, percentiles, stretch_lut, clip_stretch_lut, \
+  threshold_lut, mask_lut, apply_lut
+
+# The values of an uint8 channel, i.e. the identity lookup table
+_identity = np.arange(256, dtype=np.uint8)
+
+
+@dataclass(frozen=True)
+class Channel:
+  """Selects the channel of the subsection a branch works on.
+
+  The source is one of the attributes of :class:`Tile`, i.e. 'rgb', 'ycbcr'
+  or 'gray', and index the channel to take from it if it has several.
+  """
+
+  source: str
+  index: Optional[int] = None
+
+  def __call__(self, tile: Tile) -> np.ndarray:
+    data = getattr(tile, self.source)
+    return data if self.index is None else data[:, :, self.index]
+
+
+@dataclass(frozen=True)
+class Invert:
+  """Elementwise stage inverting an uint8 channel."""
+
+  def table(self, hist: np.ndarray) -> np.ndarray:
+    return 255 - _identity
+
+
+@dataclass(frozen=True)
+class Stretch:
+  """Elementwise stage clipping an uint8 channel between two fixed values,
+  and stretching it to the full range."""
+
+  lower: int
+  upper: int
+
+  def table(self, hist: np.ndarray) -> np.ndarray:
+    return clip_stretch_lut(self.lower, self.upper)
+
+
+@dataclass(frozen=True)
+class AutoStretch:
+  """Elementwise stage stretching the contrast of an uint8 channel between two
+  of its percentiles, the upper bound being optionally at least min_upper."""
+
+  upper: float
+  lower: float
+  min_upper: Optional[float] = None
+
+  # The percentiles are computed on the histogram of the input channel
+  needs_histogram = True
+
+  def table(self, hist: np.ndarray) -> np.ndarray:
+    upper, lower = percentiles(hist, self.upper, self.lower)
+    if self.min_upper is not None:
+      upper = max(self.min_upper, upper)
+    return stretch_lut(lower, upper)
+
+
+@dataclass(frozen=True)
+class Threshold:
+  """Elementwise stage giving a mask, 255 for the values between low and high
+  included, and 0 elsewhere."""
+
+  low: int = 0
+  high: int = 255
+
+  def table(self, hist: np.ndarray) -> np.ndarray:
+    return mask_lut(threshold_lut(_identity, self.low, self.high))
+
+
+@dataclass(frozen=True)
+class Morphology:
+  """Stage applying a morphological operation with a square kernel."""
+
+  operation: int
+  size: int
+
+  def __call__(self,
+               data: np.ndarray,
+               out: Optional[np.ndarray] = None,
+               binary: bool = False) -> np.ndarray:
+    return apply_morphology(data, self.operation, self.size, out, binary)
+
+
+@dataclass(frozen=True)
+class Apply:
+  """Stage applying any function to the output of the previous stage."""
+
+  func: Callable[[np.ndarray], np.ndarray]
+
+  def __call__(self, data: np.ndarray) -> np.ndarray:
+    return self.func(data)
+
+
+@dataclass(frozen=True)
+class All:
+  """Combines several branches into the mask of the pixels selected by all of
+  them."""
+
+  branches: Tuple[tuple, ...]
+
+  def __init__(self, *branches: tuple) -> None:
+    object.__setattr__(self, 'branches', branches)
+
+
+# The names of the morphological operations, for tracing them
+_morphology_names = {cv2.MORPH_OPEN: 'open', cv2.MORPH_CLOSE: 'close',
+                     cv2.MORPH_DILATE: 'dilate', cv2.MORPH_ERODE: 'erode'}
+
+# The stages transforming each pixel independently, that are fused together
+elementwise = (Invert, Stretch, AutoStretch, Threshold)
+
+Pipeline = Tuple[Union[Channel, All, Invert, Stretch, AutoStretch, Threshold,
+                       Morphology, Apply], ...]
+
+
+def stage_name(step) -> str:
+  """Returns the name under which a stage is traced and benchmarked."""
+
+  if isinstance(step, Morphology):
+    operation = _morphology_names.get(step.operation, str(step.operation))
+    return f'morphology {operation} {step.size}x{step.size}'
+  if isinstance(step, Apply):
+    return step.func.__name__.strip('_')
+  if isinstance(step, Channel):
+    return f'channel {step.source}'
+  return type(step).__name__
+
+
+def _is_binary(lut: np.ndarray) -> bool:
+  """Checks whether a lookup table only outputs 0 and 255."""
+
+  return bool(np.all((lut == 0) | (lut == 255)))
+
+
+def _run_branch(tile: Tile, stages: tuple) -> Tuple[np.ndarray, bool]:
+  """Runs a branch, fusing its consecutive elementwise stages into a single
+  lookup table applied in one pass over the pixels.
+
+  The lookup tables and the morphological operations write into arrays of the
+  buffer pool, and the intermediate results of the branch are given back to
+  it as soon as the next stage is done with them. The channels of the tile are
+  never given back, as they still belong to it.
+
+  Whether the data is a mask only containing 0 and 255 is known from the
+  lookup tables, and passed on to the morphological operations.
+
+  Returns:
+    The output of the branch, and whether it is such a mask.
+  """
+
+  first, *stages = stages
+  if isinstance(first, All):
+    data, binary = _run_all(tile, first)
+  else:
+    data, binary = first(tile), False
+  # Whether data is an intermediate result that can be given back to the pool
+  owned = isinstance(first, All)
+
+  def run_lut(data: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    with stage(f"lut {'+'.join(fused)}"):
+      out = apply_lut(data, lut, buffer_pool.get(data.shape, lut.dtype))
+    if owned:
+      buffer_pool.release(data)
+    return out
+
+  lut = None
+  hist = None
+  fused = list()
+  for step in stages:
+    if isinstance(step, elementwise):
+      # The histogram of the current values is derived from the one of the
+      # input, without going through the pixels again
+      if getattr(step, 'needs_histogram', False):
+        if hist is None:
+          with stage('histogram'):
+            hist = histogram(data)
+        current = hist if lut is None else np.bincount(
+          lut, weights=hist, minlength=256).astype(np.int64)
+      else:
+        current = None
+      table = step.table(current)
+      lut = table if lut is None else table[lut]
+      fused.append(stage_name(step))
+
+    else:
+      if lut is not None:
+        data, owned, binary = run_lut(data, lut), True, _is_binary(lut)
+        lut, hist = None, None
+        fused.clear()
+      with stage(stage_name(step)):
+        if isinstance(step, Morphology):
+          output = step(data, buffer_pool.get(data.shape, data.dtype), binary)
+        else:
+          output, binary = step(data), False
+      if owned and not np.shares_memory(output, data):
+        buffer_pool.release(data)
+      data, owned = output, True
+
+  if lut is not None:
+    data, binary = run_lut(data, lut), _is_binary(lut)
+  return data, binary
+
+
+def _run_all(tile: Tile, combined: All) -> Tuple[np.ndarray, bool]:
+  """Runs the branches of an All stage and combines their masks in place.
+
+  The combination only contains 0 and 255 if all the masks do.
+  """
+
+  mask = None
+  binary = True
+  for branch in combined.branches:
+    branch_mask, branch_binary = _run_branch(tile, branch)
+    binary &= branch_binary
+    if mask is None:
+      mask = branch_mask
+    else:
+      np.bitwise_and(mask, branch_mask, out=mask)
+      buffer_pool.release(branch_mask)
+    del branch_mask
+  return mask, binary
+
+
+def run_pipeline(tile: Tile, stages: Pipeline) -> np.ndarray:
+  """Runs a pipeline of stages on a subsection.
+
+  The pipeline starts either with a Channel or with an All stage. The
+  consecutive elementwise stages are fused into a single lookup table, and
+  the percentiles needed by the AutoStretch stages are computed on the
+  histogram of the channel. The other stages are run one after the other.
+
+  Args:
+    tile: The subsection to process.
+    stages: The stages of the pipeline.
+
+  Returns:
+    The output of the last stage.
+  """
+
+  return _run_branch(tile, stages)[0]
@@ -3,62 +3,232 @@
 import numpy as np
 from PIL import Image
 import cv2
-from skimage import measure, morphology, util
+from skimage import measure
+from typing import Callable, Dict, Tuple, Union
 
+from .tile import Tile
+from .buffers import buffer_pool
+from .morphology import apply_morphology
+from .trace import stage, traced
+from .pipeline import All, Channel, Invert, AutoStretch, Threshold, \
+  run_pipeline
 
-def _get_base_mask(image: Image) -> np.ndarray:
+
+# The pixels selected on the inverted Cb and Cr channels, after improving
+# their contrast
+vessel_mask = (All((Channel('ycbcr', 1), Invert(), AutoStretch(99.5, 50),
+                    Threshold(low=174)),
+                   (Channel('ycbcr', 2), Invert(), AutoStretch(99, 1),
+                    Threshold(high=130))),)
+
+
+def _get_base_mask(tile: Tile) -> np.ndarray:
   """Converts the image to YCbCr, improves the contrast, and selects the pixels
   based on two thresholds on the Cb and Cr channels.
 
   Args:
-    image: The Pillow image to process
+    tile: The subsection image to process
 
   Returns:
     The mask of the selected pixels
   """
 
-  # Switching colorspace and inverting
-  image = 255 - np.array(image.convert('YCbCr'))
+  return run_pipeline(tile, vessel_mask)
+
+
+def filter_labels(labels: np.ndarray, keep: np.ndarray) -> np.ndarray:
+  """Keeps only the selected labels of a labeled image, and renumbers them
+  sequentially in a single lookup table pass.
+
+  Args:
+    labels: The labeled image to filter, with 0 being the background.
+    keep: A boolean array indexed by label value, True for the labels to keep.
+      Its length must be greater than the maximum label. The value for the
+      background is ignored.
+
+  Returns:
+    A labeled image of the same dtype containing only the kept labels,
+    numbered from 1 in increasing order of their original value.
+  """
+
+  keep = np.asarray(keep, dtype=bool).copy()
+  keep[0] = False
+
+  # Building the lookup table mapping the kept labels to 1, 2, ..., and the
+  # other ones to the background
+  lut = np.zeros(keep.shape[0], dtype=labels.dtype)
+  lut[keep] = np.arange(1, np.count_nonzero(keep) + 1, dtype=labels.dtype)
+
+  return lut[labels]
+
+
+@traced()
+def select_labels(labels: np.ndarray,
+                  predicate: Callable[[Dict[str, np.ndarray]], np.ndarray],
+                  properties: Tuple[str, ...]) -> Tuple[np.ndarray,
+                                                        Dict[str, np.ndarray]]:
+  """Keeps only the labels whose properties satisfy a given predicate.
+
+  The properties are computed for all the labels at once using
+  :func:`skimage.measure.regionprops_table`, the predicate is evaluated on the
+  resulting arrays, and the labels are filtered with :func:`filter_labels`.
+
+  Args:
+    labels: The labeled image to filter, with 0 being the background.
+    predicate: A function taking the dict of the property arrays, and returning
+      a boolean array that is True for the labels to keep.
+    properties: The names of the properties the predicate relies on, as
+      accepted by :func:`skimage.measure.regionprops_table`.
+
+  Returns:
+    The filtered labeled image, renumbered from 1, and the properties of the
+    kept labels indexed by their new label value minus 1.
+  """
+
+  props = measure.regionprops_table(labels, properties=('label',
+                                                        *properties))
+  selected = np.asarray(predicate(props), dtype=bool)
+
+  # Marking the labels to keep in an array indexed by label value
+  keep = np.zeros(int(np.max(props['label'], initial=0)) + 1, dtype=bool)
+  keep[props['label'][selected]] = True
+
+  return (filter_labels(labels, keep),
+          {name: values[selected] for name, values in props.items()})
+
 
-  # Improving the contrast on the high values of the Cb channel
-  blue_diff = image[:, :, 1]
-  upper, lower = np.percentile(blue_diff, 99.5), np.percentile(blue_diff, 50)
-  blue_diff = np.clip((blue_diff - lower) / (upper - lower) * 255,
-                      0, 255).astype('uint8')
+def _unreached(mask: np.ndarray, connectivity: int) -> np.ndarray:
+  """Returns the mask of the set pixels that are not connected to the border
+  of the image through other set pixels.
 
-  # Improving the contrast on the Cr channel
-  red_diff = image[:, :, 2]
-  upper, lower = np.percentile(red_diff, 99), np.percentile(red_diff, 1)
-  red_diff = np.clip((red_diff - lower) / (upper - lower) * 255,
-                     0, 255).astype('uint8')
+  Args:
+    mask: The uint8 mask containing only 0 and 255.
+    connectivity: Either 4 or 8, the connectivity of the flood fill.
 
-  del image
+  Returns:
+    A mask of the same size, 255 for the unreached set pixels.
+  """
 
-  # Returning only the pixels matching the Cb and Cr thresholds
-  return (((blue_diff >= 174) & (red_diff <= 130)) * 255).astype('uint8')
+  # Padding with set pixels, so that a single flood fill reaches all the
+  # components touching the border
+  padded = cv2.copyMakeBorder(mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT,
+                              value=255)
+  cv2.floodFill(padded, None, (0, 0), 0, flags=connectivity)
+  return padded[1:-1, 1:-1]
+
+
+def _border_pixels(shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+  """Returns the y and x coordinates of the pixels on the border of an image
+  of the given shape."""
+
+  height, width = shape
+  ys = np.concatenate((np.zeros(width, dtype=int),
+                       np.full(width, height - 1), np.arange(height),
+                       np.arange(height)))
+  xs = np.concatenate((np.arange(width), np.arange(width),
+                       np.zeros(height, dtype=int),
+                       np.full(height, width - 1)))
+  return ys, xs
+
+
+@traced()
+def fill_holed_objects(mask: np.ndarray) -> bool:
+  """Keeps only the objects of a mask containing at least one hole, and fills
+  their holes, using only flood fills.
+
+  The result is exactly the same as labeling the 8-connected objects, keeping
+  the ones whose Euler number is lower than 1, and calling
+  :func:`skimage.morphology.remove_small_holes` on them with the largest
+  filled area of the kept objects as threshold, as scikit-image 0.26 does it.
+  It is obtained as follows:
+
+  * The holes counted by the Euler number are the 4-connected background
+    components not touching the border. The pixel right above the first pixel
+    of such a hole always belongs to an object enclosing it, which is kept.
+  * The largest filled area is the one of an outermost kept object, i.e. the
+    size of its 8-connected component once the holes of the kept objects are
+    filled.
+  * These holes are never larger than this area, so only the background
+    components touching the border need to be compared to it.
 
+  Args:
+    mask: The uint8 mask containing only 0 and 255, overwritten with the
+      filled kept objects.
 
-def _reindex_labels(base_label: np.ndarray,
-                    interest: np.ndarray) -> np.ndarray:
-  """Reindex the labels of a labeled image based on a given set of labels to
-  keep."""
+  Returns:
+    Whether at least one object containing a hole was found. If not, the mask
+    is left untouched.
+  """
 
-  # Creating the list of 
-  new_index = np.arange(1, base_label.shape[0] + 1)
-  to_remap = np.array([index for index in new_index if index not in interest])
-  to_leave = np.append(
-    np.array([index for index in new_index if index in interest]),
-    np.arange(np.max(new_index) + 1, np.max(base_label) + 1))
+  # Finding the 4-connected holes, and their first pixel in raster order
+  holes = _unreached(cv2.bitwise_not(mask), 4)
+  points = cv2.findNonZero(holes)
+  if points is None:
+    return False
+  points = points.reshape(-1, 2)
+  xs, ys = points[:, 0], points[:, 1]
+  top, left = ys.min(), xs.min()
+  _, labels = cv2.connectedComponents(
+    holes[top: ys.max() + 1, left: xs.max() + 1], connectivity=4,
+    ltype=cv2.CV_32S)
+  _, first = np.unique(labels[ys - top, xs - left], return_index=True)
+  seeds = [(int(x), int(y) - 1) for x, y in zip(xs[first], ys[first])]
+  del holes, points, xs, ys, labels, first
+
+  # Keeping only the objects enclosing at least one hole
+  kept = buffer_pool.get(mask.shape)
+  np.copyto(kept, mask)
+  for x, y in seeds:
+    if kept[y, x] == 255:
+      cv2.floodFill(kept, None, (x, y), 128, flags=8)
+  cv2.compare(kept, 128, cv2.CMP_EQ, dst=kept)
+
+  # Marking the background components touching the border, the other ones
+  # being the holes to fill
+  outside = cv2.bitwise_not(kept, dst=kept)
+  border_ys, border_xs = _border_pixels(mask.shape)
+  border = list()
+  while True:
+    remaining = np.flatnonzero(outside[border_ys, border_xs] == 255)
+    if not remaining.size:
+      break
+    seed = (int(border_xs[remaining[0]]), int(border_ys[remaining[0]]))
+    border.append((seed, cv2.floodFill(outside, None, seed, 1, flags=8)[0]))
+
+  # Computing the largest filled area of the kept objects
+  filled = cv2.compare(outside, 1, cv2.CMP_NE,
+                       dst=buffer_pool.get(mask.shape))
+  threshold = 0
+  for x, y in seeds:
+    if filled[y, x] == 255:
+      threshold = max(threshold, cv2.floodFill(filled, None, (x, y), 128,
+                                               flags=8)[0])
+  buffer_pool.release(filled)
+  del filled
+
+  # Also filling the background components touching the border that are not
+  # bigger than this area
+  for seed, area in border:
+    if area <= threshold:
+      cv2.floodFill(outside, None, seed, 2, flags=8)
+  cv2.compare(outside, 1, cv2.CMP_NE, dst=mask)
+  buffer_pool.release(outside)
+
+  return True
+
+
+def _large_or_all(props: Dict[str, np.ndarray]) -> np.ndarray:
+  """Selects the vessels whose filled area is at least 225 pixels.
+
+  If no vessel is that large, all of them are kept instead, as the original
+  implementation did.
+  """
 
-  base_label = util.map_array(
-    base_label, np.append(to_remap, to_leave),
-    np.append(np.arange(np.max(base_label) + 1,
-                        np.max(base_label) + 1 + len(to_remap)),
-              to_leave)).astype('int64')
-  return util.map_array(base_label, interest, new_index).astype('int64')
+  large = props['area_filled'] >= 225
+  return large if np.any(large) else np.ones_like(large)
 
 
-def process_vessels(img: Image) -> np.ndarray:
+def process_vessels(img: Union[Image.Image, Tile]) -> np.ndarray:
   """Processes the given image in order to detect blood vessels on it.
 
   First, noise is reduced using opening and closing operations. Then, a first
@@ -66,91 +236,80 @@ def process_vessels(img: Image) -> np.ndarray:
   dilated, and the ones that have a hole inside are kept. They're then filled
   up, and eroded back to their original size. Another detection is then applied
   on the original image to detect the small vessels. Only the vessels bigger
-  than a given threshold are kept. Finally, the masks containing the detected
-  small and big vessels are merged, and a final mask is returned.
+  than a given threshold are kept, unless none of them is. Finally, the masks
+  containing the detected small and big vessels are merged, and a final mask
+  is returned.
 
   Args:
-    img: The image to process, containing the stained blood vessels.
+    img: The image to process, containing the stained blood vessels. Either a
+      Pillow image or a Tile, whose derived channels are then reused.
 
   Returns:
     An image on which each detected vessel is assigned a different pixel value.
   """
 
-  # Getting the base mask
-  mask = _get_base_mask(img)
+  return detect_vessels(_get_base_mask(img if isinstance(img, Tile)
+                                      else Tile(img)))
 
-  # Removing small holes and small objects in the mask
-  mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((5, 5)))
-  mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5, 5)))
 
-  # Generating the mask for medium objects and detecting all the objects
-  mask_medium = cv2.morphologyEx(mask, cv2.MORPH_DILATE, np.ones((20, 20)))
-  labels_medium = measure.label(mask_medium, background=0, connectivity=2)
-  del mask_medium
+def detect_vessels(mask: np.ndarray) -> np.ndarray:
+  """Detects the blood vessels on the base mask computed by
+  :func:`process_vessels`.
+
+  Args:
+    mask: The uint8 mask of the pixels selected on the Cb and Cr channels.
 
-  # Getting the properties of the detected objects, and selecting the ones
-  # that contain at least one hole
-  props_medium = measure.regionprops(labels_medium)
-  obj_with_hole = np.array([prop.label for prop in props_medium
-                            if prop.euler_number < 1])
-  try:
-    max_size = max((prop.area_filled for prop in props_medium
-                    if prop.euler_number < 1))
-  except ValueError:
-    empty = True
-  else:
-    empty = False
-  del props_medium
-
-  # Processing the medium size objects only if such objects were detected
-  if not empty:
-    # Reindexing the labels to keep only the ones with a hole
-    labels_medium = _reindex_labels(labels_medium, obj_with_hole)
-    labels_medium[labels_medium > np.max(obj_with_hole)] = 0
-    del obj_with_hole
-
-    # Filling the detected holes and converting to an uint8 image
-    labels_medium = morphology.remove_small_holes(labels_medium,
-                                                  max_size, connectivity=2)
-    mask_medium = ((labels_medium > 0) * 255).astype('uint8')
-    del labels_medium
-
-    # Eroding the detected objects back to their original shape
-    mask_medium = cv2.morphologyEx(mask_medium, cv2.MORPH_ERODE,
-                                   np.ones((20, 20)))
-
-    # Adding the detected big objects to the base mask
-    mask = np.maximum(mask, mask_medium)
-    del mask_medium
-  else:
-    del obj_with_hole
+  Returns:
+    An image on which each detected vessel is assigned a different pixel value.
+  """
+
+  # Removing small holes and small objects in the mask, the results being
+  # written to buffers of the pool instead of new arrays. All the masks only
+  # contain 0 and 255, so the large kernels can work on packed bits
+  with stage('morphology close+open 5x5'):
+    closed = apply_morphology(mask, cv2.MORPH_CLOSE, 5,
+                              buffer_pool.get(mask.shape), binary=True)
+    mask = apply_morphology(closed, cv2.MORPH_OPEN, 5,
+                            buffer_pool.get(mask.shape), binary=True)
+    buffer_pool.release(closed)
+    del closed
+
+  # Generating the mask for medium objects
+  mask_medium = buffer_pool.get(mask.shape)
+  with stage('morphology dilate 20x20'):
+    apply_morphology(mask, cv2.MORPH_DILATE, 20, mask_medium, binary=True)
+
+  # Keeping only the objects that contain at least one hole, and filling
+  # them. Processing the medium size objects only if such objects were
+  # detected
+  if fill_holed_objects(mask_medium):
+    # Eroding the detected objects back to their original shape, and adding
+    # them to the base mask
+    eroded = buffer_pool.get(mask.shape)
+    with stage('morphology erode 20x20'):
+      apply_morphology(mask_medium, cv2.MORPH_ERODE, 20, eroded, binary=True)
+    np.maximum(mask, eroded, out=mask)
+    buffer_pool.release(eroded)
+    del eroded
+  buffer_pool.release(mask_medium)
+  del mask_medium
 
   # Detecting all the objects on the new mask
-  labels = measure.label(mask, background=0, connectivity=2)
+  with stage('label'):
+    labels = measure.label(mask, background=0, connectivity=2)
+  buffer_pool.release(mask)
   del mask
 
-  # Getting the properties of the detected objects, and keeping only those with
-  # an area bigger than a minimum value
-  props = measure.regionprops(labels)
-  valid_obj = np.array([prop.label for prop in props
-                        if prop.area_filled >= 225])
-  del props
-
-  # Testing whether there are valid objects on the image
-  try:
-    np.max(valid_obj)
-  except ValueError:
-    empty = True
-  else:
-    empty = False
-
-  if not empty:
-    labels = _reindex_labels(labels, valid_obj)
-    labels[labels > np.max(valid_obj)] = 0
-  del valid_obj
+  # Keeping only the objects with an area bigger than a minimum value
+  labels, _ = select_labels(labels, _large_or_all, ('area_filled',))
 
   # Generating the final uint8 image with all valid objects
-  detected = ((labels > 0) * 255).astype('uint8')
+  detected = buffer_pool.get(labels.shape)
+  np.multiply(labels > 0, np.uint8(255), out=detected)
+  del labels
 
   # Detecting each blood vessel
-  return measure.label(detected, background=0, connectivity=2)
+  with stage('label'):
+    vessels = measure.label(detected, background=0, connectivity=2)
+  buffer_pool.release(detected)
+  return vessels
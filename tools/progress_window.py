@@ -37,3 +37,57 @@ class Progress_window(tk.Toplevel):
                                        mode='determinate', length=280,
                                        variable=self.bottom_progress)
     self._bottom_bar.pack(side='top', pady=5, padx=5)
+
+
+class _Console_variable:
+  """Minimal replacement for :obj:`tk.IntVar` storing a progress value."""
+
+  def __init__(self, value: int = 0) -> None:
+    """Sets the initial value."""
+
+    self._value = value
+
+  def get(self) -> int:
+    """Returns the stored value."""
+
+    return self._value
+
+  def set(self, value: int) -> None:
+    """Stores a new value."""
+
+    self._value = value
+
+
+class Progress_console:
+  """Drop-in replacement for :class:`Progress_window` that logs the progress
+  to stdout, for running the scripts without a display."""
+
+  def __init__(self, top_title, bottom_title) -> None:
+    """Sets the titles and the variables.
+
+    Args:
+      top_title: The title of the top progress bar.
+      bottom_title: The title of the bottom progress bar.
+    """
+
+    self._top_title = top_title
+    self._bottom_title = bottom_title
+    self._last = None
+
+    # Variables storing the progress of both bars
+    self.top_progress = _Console_variable(0)
+    self.bottom_progress = _Console_variable(0)
+
+  def update(self) -> None:
+    """Prints the progress of both bars if it changed since the last call."""
+
+    current = (self.top_progress.get(), self.bottom_progress.get())
+    if current != self._last:
+      print(f"{self._top_title} {current[0]:3d}% | "
+            f"{self._bottom_title} {current[1]:3d}%", flush=True)
+      self._last = current
+
+  def destroy(self) -> None:
+    """Prints the completion of the task."""
+
+    print(f"{self._top_title} 100% | Done", flush=True)
@@ -0,0 +1,283 @@
+# coding: utf-8
+
+import tempfile
+from dataclasses import dataclass
+from math import ceil
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import cv2
+import tifffile
+from PIL import Image
+
+from .tile import Tile
+from .tiling import TileFrame, load_tiling, get_frame
+from .overlay_writer import OverlayOptions, overlay_codecs
+from .trace import stage
+
+# The side of the square tiles of the pyramidal images, in pixels
+pyramid_tile_size = 512
+
+# The value of the parts of a section not covered by any subsection
+_blank = 255
+
+
+@dataclass
+class _Placement:
+  """Where the visible part of a subsection image lies in its section."""
+
+  path: Path
+  x: int
+  y: int
+  crop: Tuple[slice, slice]
+  width: int
+  height: int
+
+
+def _layout(images: List[Path],
+            tiling: Dict[str, TileFrame],
+            with_halo: bool,
+            downsample: int) -> Tuple[List[_Placement], Tuple[int, int]]:
+  """Computes the position of each subsection image in its section, only
+  reading the headers of the images.
+
+  Args:
+    images: The subsection images of a side folder.
+    tiling: The frames of the subsections, if recorded.
+    with_halo: If True, the images include the halo of their subsection,
+      which is cropped out.
+    downsample: The factor by which the images were shrunk.
+
+  Returns:
+    The placement of each image, sorted by position along the y-axis, and the
+    height and width of the section.
+  """
+
+  placements = list()
+  for path in images:
+    with Image.open(path) as img:
+      width, height = img.size
+    frame = tiling.get(path.stem) or get_frame(
+      path.stem, (height * downsample, width * downsample))
+
+    if with_halo:
+      crop = frame.core
+      width, height = frame.width, frame.height
+    else:
+      crop = (slice(0, height), slice(0, width))
+
+    placements.append(_Placement(path, frame.x // downsample,
+                                 frame.y // downsample, crop, width, height))
+
+  placements.sort(key=lambda placement: placement.y)
+  return placements, (max(p.y + p.height for p in placements),
+                      max(p.x + p.width for p in placements))
+
+
+def _level_shapes(height: int,
+                  width: int,
+                  tile_size: int) -> List[Tuple[int, int]]:
+  """Returns the shape of each level of the pyramid, each one being half the
+  size of the previous one, down to the one fitting in a single tile."""
+
+  shapes = [(height, width)]
+  while max(shapes[-1]) > tile_size:
+    height, width = shapes[-1]
+    shapes.append((ceil(height / 2), ceil(width / 2)))
+  return shapes
+
+
+def _shrink_band(band: np.ndarray) -> np.ndarray:
+  """Shrinks a row of tiles by two along both axes, each pixel being the
+  average of a 2 x 2 block. An odd last row or column is averaged with
+  itself."""
+
+  height, width = band.shape[:2]
+  if height % 2 or width % 2:
+    band = cv2.copyMakeBorder(band, 0, height % 2, 0, width % 2,
+                              cv2.BORDER_REPLICATE)
+  return cv2.resize(band, (ceil(width / 2), ceil(height / 2)),
+                    interpolation=cv2.INTER_AREA)
+
+
+def _disk_levels(file: BinaryIO,
+                 shapes: List[Tuple[int, int]]) -> List[np.ndarray]:
+  """Returns one uint8 RGB array per given shape, all stored one after the
+  other in a temporary file instead of in memory."""
+
+  levels, offset = list(), 0
+  for height, width in shapes:
+    levels.append(np.memmap(file, dtype=np.uint8, mode='w+', offset=offset,
+                            shape=(height, width, 3)))
+    offset += height * width * 3
+  return levels
+
+
+def _full_resolution_tiles(placements: List[_Placement],
+                           shape: Tuple[int, int],
+                           tile_size: int,
+                           half: Optional[np.ndarray]) -> Iterator[np.ndarray]:
+  """Yields the tiles of the full resolution level, row by row.
+
+  The subsection images are decoded only once, when the first row of tiles
+  they overlap is reached, and forgotten once their last one is written. Only
+  about one row of subsections is thus held in memory. Each row of tiles is
+  also shrunk by two into the half resolution level, if given.
+  """
+
+  height, width = shape
+  n_x = ceil(width / tile_size)
+  decoded: Dict[int, np.ndarray] = dict()
+  next_image = 0
+
+  for band_y in range(0, height, tile_size):
+
+    # Decoding the images starting in this row of tiles
+    while (next_image < len(placements)
+           and placements[next_image].y < band_y + tile_size):
+      placement = placements[next_image]
+      decoded[next_image] = Tile.open(placement.path).rgb[placement.crop]
+      next_image += 1
+
+    # Pasting the visible parts of the images on the row of tiles
+    band = np.full((tile_size, n_x * tile_size, 3), _blank, dtype=np.uint8)
+    for index, pixels in list(decoded.items()):
+      placement = placements[index]
+      if placement.y + placement.height <= band_y:
+        del decoded[index]
+        continue
+      top = max(band_y, placement.y)
+      bottom = min(band_y + tile_size, placement.y + placement.height)
+      band[top - band_y: bottom - band_y,
+           placement.x: placement.x + placement.width] = \
+        pixels[top - placement.y: bottom - placement.y]
+
+    if half is not None:
+      shrunk = _shrink_band(band[:min(tile_size, height - band_y), :width])
+      half[band_y // 2: band_y // 2 + shrunk.shape[0]] = shrunk
+      del shrunk
+
+    for x_id in range(n_x):
+      yield band[:, x_id * tile_size: (x_id + 1) * tile_size]
+
+
+def _level_tiles(level: np.ndarray,
+                 tile_size: int,
+                 lower: Optional[np.ndarray]) -> Iterator[np.ndarray]:
+  """Yields the tiles of a lower resolution level, row by row, only reading
+  one row of tiles of it at once. Each row of tiles is also shrunk by two
+  into the next level, if given."""
+
+  height, width = level.shape[:2]
+  n_x = ceil(width / tile_size)
+
+  for band_y in range(0, height, tile_size):
+    rows = np.array(level[band_y: band_y + tile_size])
+    if lower is not None:
+      shrunk = _shrink_band(rows)
+      lower[band_y // 2: band_y // 2 + shrunk.shape[0]] = shrunk
+      del shrunk
+
+    band = np.full((tile_size, n_x * tile_size, 3), _blank, dtype=np.uint8)
+    band[:rows.shape[0], :width] = rows
+    del rows
+    for x_id in range(n_x):
+      yield band[:, x_id * tile_size: (x_id + 1) * tile_size]
+
+
+def write_pyramid(images: List[Path],
+                  out_path: Path,
+                  tiling: Optional[Dict[str, TileFrame]] = None,
+                  with_halo: bool = False,
+                  downsample: int = 1,
+                  level: Optional[int] = None,
+                  tile_size: int = pyramid_tile_size) -> None:
+  """Assembles the subsection images of a section into a single tiled and
+  multi-resolution TIFF image.
+
+  The full resolution level is written row of tiles by row of tiles, and the
+  lower resolutions are stored as sub-images of it, so that viewers only
+  decode the tiles of the displayed area at the displayed zoom. The parts of
+  the section not covered by any image, e.g. the skipped subsections, are
+  white.
+
+  Each lower resolution is obtained by shrinking the rows of tiles of the
+  previous one as they are written. As the levels are written one after the
+  other, the lower ones wait in a temporary file next to the TIFF image, so
+  that only about one row of subsections and one row of tiles per level are
+  held in memory.
+
+  Args:
+    images: The subsection images to assemble.
+    out_path: The path where to write the TIFF image.
+    tiling: The frames of the subsections. The missing ones are deduced from
+      the name of the images.
+    with_halo: If True, the images include the halo of their subsection,
+      which is cropped out.
+    downsample: The factor by which the images were shrunk, the section being
+      assembled at this scale.
+    level: The compression level of the tiles, from 0 to 9.
+    tile_size: The side of the tiles, in pixels. Must be even.
+  """
+
+  placements, shape = _layout(images, tiling or dict(), with_halo, downsample)
+  shapes = _level_shapes(*shape, tile_size)
+
+  options = dict(tile=(tile_size, tile_size), photometric='rgb',
+                 compression='zlib',
+                 compressionargs=None if level is None else {'level': level})
+
+  with stage('pyramid', section=str(out_path.parent)), \
+      tempfile.TemporaryFile(dir=out_path.parent) as file, \
+      tifffile.TiffWriter(out_path, bigtiff=True) as tiff:
+    levels = _disk_levels(file, shapes[1:]) + [None]
+    tiff.write(_full_resolution_tiles(placements, shape, tile_size,
+                                      levels[0]),
+               shape=(*shape, 3), dtype=np.uint8, subifds=len(shapes) - 1,
+               **options)
+
+    # Each lower resolution is written while shrinking it into the next one
+    for previous, lower in zip(levels[:-1], levels[1:]):
+      tiff.write(_level_tiles(previous, tile_size, lower),
+                 shape=previous.shape, dtype=np.uint8, subfiletype=1,
+                 **options)
+    del levels
+
+
+def write_side_pyramids(side_fold: Path,
+                        overlay: OverlayOptions,
+                        names: Optional[List[str]] = None) -> None:
+  """Writes the pyramidal images of a side folder requested by the options,
+  for the Processed_images and the Raw_images folders.
+
+  The images are written next to these folders, with the same name and the
+  .tif extension. A folder without any image is ignored.
+
+  Args:
+    side_fold: The side folder whose subsections to assemble.
+    overlay: How the processed images were written, and which pyramidal
+      images to write.
+    names: The names of the subsections to assemble, without extension, so
+      that the images left by previous runs with a different tiling are
+      ignored. The subsections without image are skipped. If not given, all
+      the images of the folders are assembled.
+  """
+
+  tiling = load_tiling(side_fold)
+  sources = list()
+  if overlay.pyramid:
+    sources.append(('Processed_images', overlay_codecs[overlay.codec], False,
+                    overlay.downsample))
+  if overlay.pyramid_raw:
+    sources.append(('Raw_images', '.png', True, 1))
+
+  for folder_name, extension, with_halo, downsample in sources:
+    if names is None:
+      images = sorted((side_fold / folder_name).glob(f'*{extension}'))
+    else:
+      images = [side_fold / folder_name / f'{name}{extension}'
+                for name in names]
+      images = sorted(path for path in images if path.is_file())
+    if images:
+      write_pyramid(images, side_fold / f'{folder_name}.tif', tiling,
+                    with_halo, downsample, overlay.level)
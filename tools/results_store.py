@@ -0,0 +1,208 @@
+# coding: utf-8
+
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+from openpyxl import load_workbook
+
+# The name of the columnar results file written in each side folder
+results_file_name = 'data.npz'
+
+# The prefix and suffix of the cache files storing the areas read from a data
+# file, written next to it
+cache_prefix, cache_suffix = '.', '.areas.npz'
+
+
+def write_results(path: Path,
+                  choice: str,
+                  slide: str,
+                  side: str,
+                  tiles: List[str],
+                  overall_areas: List[int],
+                  stained_areas: List[int],
+                  objects: List[Dict[str, np.ndarray]],
+                  properties: Sequence[str] = ()) -> None:
+  """Writes the results of the processing of a side folder to a compressed
+  .npz file, with one column per measured property.
+
+  Each object gets one row, with its slide, side and tile names in the
+  corresponding columns. The overall and stained areas are stored per tile
+  in the tile_name, tile_overall_area and tile_stained_area columns.
+
+  Args:
+    path: The path to the .npz file to write.
+    choice: The type of processing that was performed.
+    slide: The name of the slide the side folder belongs to.
+    side: The name of the side folder, i.e. Left, Center or Right.
+    tiles: The name of each processed subsection.
+    overall_areas: The overall section area of each subsection.
+    stained_areas: The stained area of each subsection.
+    objects: For each subsection, the measurements of the detected objects as
+      one array per property.
+    properties: The properties to write a column for even if there is no
+      subsection, in which case the column is empty.
+  """
+
+  nb_obj = [len(next(iter(obj.values()), ())) for obj in objects]
+  total = sum(nb_obj)
+
+  columns = {'stain': np.array(choice),
+             'tile_name': np.array(tiles, dtype=str),
+             'tile_overall_area': np.array(overall_areas, dtype=np.int64),
+             'tile_stained_area': np.array(stained_areas, dtype=np.int64),
+             'slide': np.full(total, slide),
+             'side': np.full(total, side),
+             'tile': np.repeat(np.array(tiles, dtype=str), nb_obj),
+             'index': np.arange(1, total + 1)}
+
+  # One column per measured property, always including the given ones
+  for prop in dict.fromkeys((*properties, *(objects[0] if objects else ()))):
+    columns[prop] = np.concatenate([obj[prop] for obj in objects]) \
+      if objects else np.empty(0)
+
+  np.savez_compressed(path, **columns)
+
+
+def read_results(path: Path) -> Dict[str, np.ndarray]:
+  """Reads a results file written by :func:`write_results`.
+
+  Args:
+    path: The path to the .npz file.
+
+  Returns:
+    The columns of the file, along with the overall_area and stained_area of
+    the entire side folder.
+  """
+
+  with np.load(path, allow_pickle=False) as file:
+    columns = {key: file[key] for key in file.files}
+
+  columns['overall_area'] = int(np.sum(columns['tile_overall_area']))
+  columns['stained_area'] = int(np.sum(columns['tile_stained_area']))
+  return columns
+
+
+def load_results(folder: Path) -> Dict[str, np.ndarray]:
+  """Gathers the objects of all the results files found in a folder and its
+  sub-folders, for querying them across slides.
+
+  Args:
+    folder: The folder in which to look for results files.
+
+  Returns:
+    The concatenation of the per-object columns of all the results files.
+    The columns that are not defined in all the files are dropped.
+  """
+
+  files = [read_results(path)
+           for path in sorted(folder.rglob(results_file_name))]
+  if not files:
+    return dict()
+
+  per_object = [key for key, val in files[0].items()
+                if not key.startswith('tile_') and np.ndim(val) == 1
+                and all(key in file for file in files)]
+  return {key: np.concatenate([file[key] for file in files])
+          for key in per_object}
+
+
+def find_data_files(folder: Path) -> List[Path]:
+  """Lists the data files in a folder and its sub-folders, preferring the
+  data.npz file over the data.xlsx one when a folder contains both.
+
+  Args:
+    folder: The folder in which to look for data files.
+
+  Returns:
+    The paths to the data files, one per folder containing results.
+  """
+
+  files = dict()
+  for path in (*folder.rglob('*.xlsx'), *folder.rglob(results_file_name)):
+    if path.parent not in files or path.name == results_file_name:
+      files[path.parent] = path
+  return list(files.values())
+
+
+def read_areas(path: Path) -> Tuple[np.ndarray, int]:
+  """Reads the areas of the detected objects and the overall section area from
+  a data file, either a data.npz or a data.xlsx one.
+
+  Args:
+    path: The path to the data file.
+
+  Returns:
+    The area of each object in pixels, and the overall section area in pixels.
+  """
+
+  if path.suffix == '.npz':
+    results = read_results(path)
+    areas = results.get('area_filled', np.empty(0))
+    return areas.astype(np.float64), results['overall_area']
+
+  # The areas are in the third column, and the overall area in the F2 cell
+  workbook = load_workbook(path, read_only=True)
+  sheet = workbook.active
+  values = [row[2] for row in sheet.iter_rows(min_row=2, values_only=True)
+            if len(row) > 2 and row[2] is not None]
+  overall_area = sheet['F2'].value
+  workbook.close()
+
+  return np.array(values, dtype=np.float64), overall_area
+
+
+def load_areas(path: Path) -> Tuple[np.ndarray, int]:
+  """Same as :func:`read_areas`, except the areas read from the data file are
+  cached on the disk next to it.
+
+  The cache is keyed by the modification time and size of the data file, so
+  that it is only used as long as the data file is left unchanged.
+
+  Args:
+    path: The path to the data file.
+
+  Returns:
+    The area of each object in pixels, and the overall section area in pixels.
+  """
+
+  # The columnar files are fast enough to read, no need for caching them
+  if path.suffix == '.npz':
+    return read_areas(path)
+
+  stat = path.stat()
+  cache = path.parent / f'{cache_prefix}{path.name}{cache_suffix}'
+
+  # Reading the areas from the cache if it is still valid
+  try:
+    with np.load(cache, allow_pickle=False) as file:
+      if (int(file['mtime_ns']) == stat.st_mtime_ns
+              and int(file['size']) == stat.st_size):
+        return file['areas'], int(file['overall_area'])
+  except (OSError, KeyError, ValueError):
+    pass
+
+  # Otherwise, reading the data file and updating the cache
+  areas, overall_area = read_areas(path)
+  try:
+    np.savez(cache, mtime_ns=stat.st_mtime_ns, size=stat.st_size,
+             areas=areas, overall_area=overall_area)
+  except OSError:
+    pass
+
+  return areas, overall_area
+
+
+def load_folder_areas(folder: Path) -> List[Tuple[str, np.ndarray, int]]:
+  """Loads the areas of all the data files found in a folder and its
+  sub-folders.
+
+  Args:
+    folder: The folder in which to look for data files.
+
+  Returns:
+    For each data file, the name of its folder, the area of each object in
+    pixels, and the overall section area in pixels.
+  """
+
+  return [(file.parent.stem, *load_areas(file))
+          for file in find_data_files(folder)]
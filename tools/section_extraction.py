@@ -0,0 +1,322 @@
+# coding: utf-8
+
+from pathlib import Path
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional, Iterator, Tuple, Union
+import os
+
+import numpy as np
+
+from .slide_tools import OpenSlide, get_portion, get_thumbnail
+from .manual_selection import Box
+from .detect_section import detect_section
+from .tiling import TileFrame, get_tiling, save_tiling, get_tile_grid
+
+# The names of the folders of the successive sections of a slide
+nr_to_dir = {0: 'Left', 1: 'Center', 2: 'Right'}
+
+# The number of subsections along the x and y axes, or in both directions
+Grid = Union[int, Tuple[int, int]]
+
+# The slides opened by the current process, with the pid that opened them
+_open_slides: Dict[Path, OpenSlide] = dict()
+_open_slides_pid: Optional[int] = None
+
+
+def _get_slide(slide_path: Path) -> OpenSlide:
+  """Returns an OpenSlide handle on the given slide, opened only once per
+  process.
+
+  The handles are never shared between processes, so a forked worker opens
+  its own handles instead of reusing the ones of its parent.
+  """
+
+  global _open_slides_pid
+
+  if _open_slides_pid != os.getpid():
+    _open_slides.clear()
+    _open_slides_pid = os.getpid()
+
+  if slide_path not in _open_slides:
+    _open_slides[slide_path] = OpenSlide(slide_path)
+  return _open_slides[slide_path]
+
+
+def close_slides() -> None:
+  """Closes all the slides opened by the current process."""
+
+  if _open_slides_pid == os.getpid():
+    for slide in _open_slides.values():
+      slide.close()
+  _open_slides.clear()
+
+
+def save_portion(slide_path: Path,
+                 label: Box,
+                 thumb_factor: int,
+                 n_slices: Grid,
+                 x_id: int,
+                 y_id: int,
+                 out_path: Path,
+                 halo: int = 0) -> None:
+  """Reads a subsection of a slide and saves it as a .png image.
+
+  Args:
+    slide_path: The path to the .ndpi file.
+    label: The box containing the target area of the slide.
+    thumb_factor: The zoom factor used for obtaining the thumbnail.
+    n_slices: The number of subsections the entire image is cut to in each
+      direction, or a tuple giving this number along the x and y axes.
+    x_id: The index of the subsection along the x-axis.
+    y_id: The index of the subsection along the y-axis.
+    out_path: The path where to save the subsection.
+    halo: The number of pixels by which the subsection is extended on each
+      side, overlapping with the neighbouring subsections.
+  """
+
+  get_portion(_get_slide(slide_path), label, thumb_factor, n_slices,
+              x_id, y_id, halo).save(out_path)
+
+
+def get_side_folder(img_path: Path, section_nr: int) -> Path:
+  """Returns the folder where the results of a given section of a slide are
+  stored."""
+
+  return img_path.parent / img_path.stem / nr_to_dir[section_nr]
+
+
+def get_raw_folder(img_path: Path, section_nr: int) -> Path:
+  """Returns the Raw_images folder of a given section of a slide, and creates
+  it if needed."""
+
+  folder = get_side_folder(img_path, section_nr) / 'Raw_images'
+  Path.mkdir(folder, exist_ok=True, parents=True)
+  return folder
+
+
+def _prepare_section(img_path: Path,
+                     section_nr: int,
+                     tiling: Dict[str, TileFrame]) -> Path:
+  """Creates the Raw_images folder of a section, describes its subsections in
+  the tiling.json file of the side folder, and returns the Raw_images
+  folder."""
+
+  folder = get_raw_folder(img_path, section_nr)
+  save_tiling(folder.parent, tiling)
+  return folder
+
+
+def get_grid(label: Box,
+             thumb_factor: int,
+             nb_tile: int = 4,
+             memory_budget: Optional[float] = None,
+             halo: int = 0) -> Grid:
+  """Returns the number of subsections to cut a section into.
+
+  Args:
+    label: The box containing the section on the thumbnail.
+    thumb_factor: The zoom factor used for obtaining the thumbnail.
+    nb_tile: The number of subsections in each direction, used if no memory
+      budget is given.
+    memory_budget: The maximum memory for processing one subsection, in bytes.
+      If given, the size of the subsections is chosen accordingly.
+    halo: The number of pixels by which the subsections are extended.
+
+  Returns:
+    Either nb_tile, or the number of subsections along the x and y axes.
+  """
+
+  if memory_budget is None:
+    return nb_tile
+  return get_tile_grid(label, thumb_factor, memory_budget, halo)
+
+
+def iter_grid(grid: Grid) -> Iterator[Tuple[int, int]]:
+  """Iterates over the indexes of the subsections of a grid along x and y."""
+
+  n_x, n_y = (grid, grid) if isinstance(grid, int) else grid
+  return product(range(n_x), range(n_y))
+
+
+def list_sections(chosen_images: Dict[Path, List[Box]],
+                  nb_tile: int = 4,
+                  memory_budget: Optional[float] = None,
+                  halo: int = 0,
+                  min_coverage: float = 0.) -> Iterator[
+                    Tuple[Path, int, Box, int, Grid, Dict[str, TileFrame]]]:
+  """Lists the selected sections of each slide, along with the subsections
+  to cut them into.
+
+  Args:
+    chosen_images: For each .ndpi file, the list of the sections to extract.
+    nb_tile: The number of subsections in each direction.
+    memory_budget: The maximum memory for processing one subsection, in bytes.
+      If given, it replaces nb_tile and the grid is chosen for each section.
+    halo: The number of pixels by which the subsections are extended.
+    min_coverage: If strictly positive, the tissue is detected on the
+      thumbnail of each slide, and the subsections whose fraction covered by
+      tissue is below this value are marked as skipped in the tiling.
+
+  Returns:
+    An iterator yielding for each section the path to the slide, the number
+    of the section, its box, the zoom factor of the thumbnail, the grid the
+    section is cut into, and the frame of each of its subsections.
+  """
+
+  for img_path, labels in chosen_images.items():
+
+    # Getting the zoom factor of the thumbnail the boxes were drawn on
+    slide = OpenSlide(img_path)
+    thumb_size, factor_thumb = get_thumbnail(slide, 4000)
+
+    # Detecting the tissue on the thumbnail, only if needed
+    tissue_map = None
+    if min_coverage > 0 and labels:
+      tissue_map = detect_section(np.array(
+        slide.get_thumbnail((thumb_size, thumb_size)))) > 0
+    slide.close()
+
+    for j, label in enumerate(labels):
+      grid = get_grid(label, factor_thumb, nb_tile, memory_budget, halo)
+      yield img_path, j, label, factor_thumb, grid, get_tiling(
+        label, factor_thumb, grid, halo, tissue_map, min_coverage)
+
+
+def extract_sections(chosen_images: Dict[Path, List[Box]],
+                     progress,
+                     nb_tile: int = 4,
+                     workers: int = 1,
+                     max_in_flight: Optional[int] = None,
+                     halo: int = 0,
+                     memory_budget: Optional[float] = None,
+                     min_coverage: float = 0.) -> None:
+  """Cuts the selected sections of each slide into subsections, and saves
+  them in the Raw_images folder of each section.
+
+  In the parallel mode, the subsections of all the slides are read and
+  encoded by a pool of worker processes, each of them holding its own
+  OpenSlide handles. At most max_in_flight subsections are submitted at once,
+  so that the memory usage stays bounded.
+
+  Args:
+    chosen_images: For each .ndpi file, the list of the sections to extract.
+    progress: The progress window or console to update.
+    nb_tile: The number of subsections in each direction.
+    workers: The number of worker processes to use. If 1, everything is
+      extracted in the current process.
+    max_in_flight: The maximum number of subsections submitted to the workers
+      and not yet saved, defaults to twice the number of workers.
+    halo: The number of pixels by which the subsections are extended on each
+      side, overlapping with their neighbours. The position of each
+      subsection is saved to the tiling.json file of each side folder.
+    memory_budget: The maximum memory for processing one subsection, in bytes.
+      If given, each section is cut into as many subsections as needed for
+      fitting in it, instead of nb_tile in each direction. The resulting
+      grid is recorded in the tiling.json file of each side folder.
+    min_coverage: The subsections whose fraction covered by tissue, as
+      estimated on the thumbnail of the slide, is below this value are not
+      extracted. They are marked as skipped in the tiling.json file, along
+      with their estimated tissue area.
+  """
+
+  nb_sections = sum((len(img_list) for img_list in chosen_images.values()))
+  section_count = 0
+  sections = list_sections(chosen_images, nb_tile, memory_budget, halo,
+                           min_coverage)
+
+  # Extracting the subsections one after the other
+  if workers <= 1:
+    slide_path = None
+    for img_path, j, label, factor_thumb, grid, tiling in sections:
+
+      if img_path != slide_path:
+        slide_path = img_path
+        print(f"Now saving the section : {img_path.stem}")
+
+      # Updating the progress bar
+      progress.top_progress.set(int(100 * section_count / nb_sections))
+      progress.update()
+      section_count += 1
+
+      # Creating the folder for storing the subsections
+      folder = _prepare_section(img_path, j, tiling)
+
+      # Iterating over each subsection
+      portions = list(iter_grid(grid))
+      for k, (x, y) in enumerate(portions):
+
+        # Updating the progress bar
+        progress.bottom_progress.set(int(100 * k / len(portions)))
+        progress.update()
+
+        # Not extracting the subsections containing only background
+        name = f'Section_{x + 1}_{y + 1}'
+        if tiling[name].skipped:
+          continue
+
+        # Saving the subsection
+        save_portion(img_path, label, factor_thumb, grid, x, y,
+                     folder / f'{name}.png', halo)
+
+    close_slides()
+    return
+
+  if max_in_flight is None:
+    max_in_flight = 2 * workers
+
+  # Listing all the subsections to extract
+  tasks = list()
+  nb_skipped = 0
+  for img_path, j, label, factor_thumb, grid, tiling in sections:
+    folder = _prepare_section(img_path, j, tiling)
+    for x, y in iter_grid(grid):
+      name = f'Section_{x + 1}_{y + 1}'
+      if tiling[name].skipped:
+        nb_skipped += 1
+        continue
+      tasks.append(((img_path, j),
+                    (img_path, label, factor_thumb, grid, x, y,
+                     folder / f'{name}.png', halo)))
+
+  # The number of subsections left to extract in each section
+  remaining = dict()
+  for section, _ in tasks:
+    remaining[section] = remaining.get(section, 0) + 1
+  section_count = nb_sections - len(remaining)
+
+  nb_tiles = len(tasks)
+  print(f"Now saving {nb_tiles} subsections of {nb_sections} sections "
+        f"using {workers} workers"
+        + (f", skipping {nb_skipped} background subsections"
+           if nb_skipped else ""))
+
+  tile_count = 0
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    pending = dict()
+    tasks = iter(tasks)
+
+    while True:
+      # Keeping the number of submitted subsections below the limit
+      for section, task in tasks:
+        pending[executor.submit(save_portion, *task)] = section
+        if len(pending) >= max_in_flight:
+          break
+
+      if not pending:
+        break
+
+      done, _ = wait(pending, return_when=FIRST_COMPLETED)
+      for future in done:
+        # Raising any exception that occurred in a worker
+        future.result()
+        section = pending.pop(future)
+        tile_count += 1
+        remaining[section] -= 1
+        if not remaining[section]:
+          section_count += 1
+
+      # Updating the progress bar
+      progress.top_progress.set(int(100 * section_count / nb_sections))
+      progress.bottom_progress.set(int(100 * tile_count / nb_tiles))
+      progress.update()
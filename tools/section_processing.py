@@ -0,0 +1,809 @@
+# coding: utf-8
+
+import numpy as np
+from PIL import Image
+from skimage import measure
+from pathlib import Path
+from xlsxwriter import Workbook
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from .detect_section import section_area
+from .manual_selection import Box
+from .slide_tools import get_portion
+from .section_extraction import list_sections, iter_grid, get_side_folder, \
+  _get_slide, close_slides
+from .results_store import write_results, results_file_name
+from .manifest import hash_file, hash_region, load_manifest, \
+  append_manifest, save_manifest
+from .tile import Tile
+from .buffers import buffer_pool
+from .overlay_writer import OverlayOptions, write_overlay, start_writer, \
+  wait_writer, stop_writer
+from .trace import stage, trace_tile, tracing_enabled, memory_tracing, \
+  run_traced, add_events
+from .pipeline import run_pipeline
+from .stains import stains
+from .outline import outline_objects
+from .pyramid import write_side_pyramids
+from .tiling import TileFrame, get_tiling, save_tiling, load_tiling, \
+  get_frame, tiling_file_name
+
+# The stainings for which individual objects are detected and measured
+object_types = {name: stain.object_name for name, stain in stains.items()
+                if stain.object_name is not None}
+
+# The properties measured on each object, and their name in the data sheet
+object_columns = {'axis_minor_length': 'smaller diameter',
+                  'area_filled': 'area',
+                  'perimeter': 'perimeter'}
+
+# The position of the centroid of each object in its section, in pixels
+position_columns = ('section_x', 'section_y')
+
+
+def _no_objects() -> Dict[str, np.ndarray]:
+  """Returns empty measurement arrays, for subsections without objects."""
+
+  return {prop: np.empty(0) for prop in (*object_columns, *position_columns)}
+
+
+@dataclass
+class TileResult:
+  """Holds the measurements performed on a single subsection image.
+
+  The properties of the detected objects are stored as one array per entry of
+  object_columns, with one value per object. The downsample factor of the
+  section detection the overall area was measured with is also recorded, as
+  well as the options the processed image was written with, if any.
+  """
+
+  name: str = ''
+  overall_area: int = 0
+  stained_area: int = 0
+  objects: Dict[str, np.ndarray] = field(default_factory=_no_objects)
+  input_hash: str = ''
+  mask_downsample: int = 1
+  overlay: Optional[dict] = None
+
+  def to_entry(self, choice: str) -> dict:
+    """Returns the manifest entry recording this result."""
+
+    return {'hash': self.input_hash, 'stain': choice,
+            'overall_area': self.overall_area,
+            'stained_area': self.stained_area,
+            'mask_downsample': self.mask_downsample,
+            'overlay': self.overlay,
+            'objects': {prop: np.asarray(values).tolist()
+                        for prop, values in self.objects.items()}}
+
+  @classmethod
+  def from_entry(cls, name: str, entry: dict) -> 'TileResult':
+    """Rebuilds a result from its manifest entry."""
+
+    return cls(name=name, overall_area=entry['overall_area'],
+               stained_area=entry['stained_area'],
+               objects={prop: np.array(values, dtype=np.float64)
+                        for prop, values in entry['objects'].items()},
+               input_hash=entry['hash'],
+               mask_downsample=entry.get('mask_downsample', 1),
+               overlay=entry.get('overlay'))
+
+
+def _is_done(entry: Optional[dict], input_hash: str, choice: str,
+             mask_downsample: int, overlay: OverlayOptions,
+             *outputs: Path) -> bool:
+  """Checks whether a manifest entry matches the given input, type of
+  processing and section detection, whether the processed image was written
+  with the given options if one is expected, and whether all the expected
+  output files exist."""
+
+  return (entry is not None and entry.get('hash') == input_hash
+          and entry.get('stain') == choice
+          and entry.get('mask_downsample', 1) == mask_downsample
+          and (not overlay.enabled
+               or entry.get('overlay') == overlay.signature)
+          and set(entry.get('objects', ())) == set(_no_objects())
+          and all(path.exists() for path in outputs))
+
+
+def _has_subsections(side_fold: Path) -> bool:
+  """Checks whether a side folder holds subsections to process.
+
+  A side folder qualifies if its Raw_images folder contains .png images, or
+  if its tiling.json file describes subsections that were all skipped for
+  containing only background. A side folder whose subsections were
+  processed directly from the slides, without saving them, has neither. It
+  is skipped with a warning, so that its data files are left untouched.
+  """
+
+  if any((side_fold / 'Raw_images').glob('*.png')):
+    return True
+
+  tiling = load_tiling(side_fold)
+  if tiling and all(frame.skipped for frame in tiling.values()):
+    return True
+  if tiling:
+    print(f"No subsection image found in {side_fold} although it should "
+          f"contain some, skipping it")
+  return False
+
+
+def get_side_folders(folder: Path) -> List[Path]:
+  """Returns the sub-folders of a section folder holding subsections.
+
+  Args:
+    folder: The folder of a section, containing the Left, Center and Right
+      sub-folders.
+
+  Returns:
+    The list of the sub-folders holding subsections, as checked by
+    :func:`_has_subsections`, so that the side folders whose subsections
+    were all skipped still get a data file.
+  """
+
+  return [dir_ for dir_ in folder.iterdir() if dir_.is_dir()
+          and _has_subsections(dir_)]
+
+
+def get_section_folders(folder: Path) -> List[Path]:
+  """Returns the section folders of a working directory that may hold
+  subsections.
+
+  Args:
+    folder: The working directory, containing one folder per .ndpi file.
+
+  Returns:
+    The list of the section folders with at least one side folder containing
+    a Raw_images folder or a tiling.json file. The side folders to process
+    are then selected by :func:`get_side_folders`.
+  """
+
+  return [fold for fold in folder.iterdir() if fold.is_dir()
+          and any(side_fold.is_dir()
+                  and ((side_fold / tiling_file_name).is_file()
+                       or (side_fold / 'Raw_images').is_dir())
+                  for side_fold in fold.iterdir())]
+
+
+def process_image(img: Union[Image.Image, Tile],
+                  choice: str,
+                  frame: Optional[TileFrame] = None,
+                  with_image: bool = True,
+                  mask_downsample: int = 1) -> Tuple[TileResult,
+                                                     Optional[np.ndarray]]:
+  """Applies the selected processing to one subsection image.
+
+  If the subsection overlaps with its neighbours, the whole image is processed
+  but only its core is accounted for. The areas are only counted on the core,
+  and an object is only kept if its centroid lies in the core. As long as the
+  halo is larger than the objects, an object crossing the border between two
+  subsections is thus entirely visible in both of them, and counted exactly
+  once.
+
+  Args:
+    img: The subsection to process, either as a Pillow image or as a Tile.
+      The image is decoded and converted to each colorspace only once.
+    choice: The type of processing to perform, one of processing_types.
+    frame: The position of the subsection in its section. If not given, the
+      subsection is assumed to have no halo and to lie at the origin of the
+      section.
+    with_image: If False, the image to save in the Processed_images folder is
+      not generated, and None is returned instead.
+    mask_downsample: The factor by which the image is shrunk for detecting
+      the section areas when counting the overall area. 1 means full
+      resolution, see :func:`~tools.detect_section.section_mask_accuracy`.
+
+  Returns:
+    The measurements performed on the image, and the image to save in the
+    Processed_images folder, cropped to the core of the subsection.
+  """
+
+  if choice not in stains:
+    raise ValueError(f"Unknown processing type : {choice}")
+  stain = stains[choice]
+
+  result = TileResult(mask_downsample=mask_downsample)
+  tile = img if isinstance(img, Tile) else Tile(img)
+  del img
+
+  if frame is None:
+    frame = TileFrame(0, 0, tile.shape[1], tile.shape[0])
+  core = frame.core
+
+  # Counting the overall area
+  result.overall_area = section_area(tile.gray, core, mask_downsample)
+
+  with stage('pipeline', stain=choice):
+    output = run_pipeline(tile, stain.pipeline)
+
+  # Detecting the objects, for the blood vessel and S100 stainings
+  if stain.object_name is not None:
+    labels = output
+    del output
+
+    # Generating the outline image
+    image_out = None
+    if with_image:
+      with stage('outline'):
+        image_out = outline_objects(tile.rgb, labels, stain.color, core)
+    tile.release()
+
+    # Calculating the properties of all the detected objects at once
+    with stage('regionprops'):
+      props = measure.regionprops_table(
+        labels, properties=(*object_columns, 'centroid'))
+    del labels
+
+    # Keeping only the objects whose centroid lies in the core
+    y_pos = props['centroid-0'] - frame.halo
+    x_pos = props['centroid-1'] - frame.halo
+    owned = ((y_pos >= 0) & (y_pos < frame.height) &
+             (x_pos >= 0) & (x_pos < frame.width))
+    result.objects = {prop: props[prop][owned] for prop in object_columns}
+    result.objects['section_x'] = x_pos[owned] + frame.x
+    result.objects['section_y'] = y_pos[owned] + frame.y
+
+    return result, image_out
+
+  # Otherwise, counting the stained area
+  tile.release()
+  stained = output[core]
+  result.stained_area = int(np.count_nonzero(stained))
+
+  # Marking the stained area with the color of the stain
+  image_out = None
+  if with_image:
+    with stage('overlay'):
+      image_out = stain.overlay(stained)
+  del stained
+  buffer_pool.release(output)
+
+  return result, image_out
+
+
+def process_tile(image_path: Path,
+                 choice: str,
+                 frame: Optional[TileFrame] = None,
+                 overlay: OverlayOptions = OverlayOptions(),
+                 mask_downsample: int = 1,
+                 entry: Optional[dict] = None) -> TileResult:
+  """Processes one subsection image stored in a Raw_images folder, and saves
+  the processed image in the neighbouring Processed_images folder.
+
+  Args:
+    image_path: The path to the .png image of the subsection.
+    choice: The type of processing to perform, one of processing_types.
+    frame: The position of the subsection in its section, as recorded in the
+      tiling.json file of its side folder. If not given, it is deduced from
+      the name of the image.
+    overlay: How to write the processed image, if at all.
+    mask_downsample: The factor by which the image is shrunk for detecting
+      the section areas.
+    entry: The manifest entry of the subsection from a previous run, if any.
+      If it matches the current image, type of processing and options, the
+      image is not processed again and the recorded result is returned.
+
+  Returns:
+    The measurements performed on the image.
+  """
+
+  outputs = list()
+  if overlay.enabled:
+    outputs.append(overlay.path(image_path.parent.parent / 'Processed_images',
+                                image_path.stem))
+
+  # Skipping the subsection if it was already processed
+  with stage('hash'):
+    input_hash = hash_file(image_path)
+  if _is_done(entry, input_hash, choice, mask_downsample, overlay, *outputs):
+    return TileResult.from_entry(image_path.stem, entry)
+
+  # Opening the subsection and processing it
+  tile = Tile.open(image_path)
+  if frame is None:
+    frame = get_frame(image_path.stem, tile.shape)
+  result, image_out = process_image(tile, choice, frame, overlay.enabled,
+                                    mask_downsample)
+  del tile
+  result.name = image_path.stem
+  result.input_hash = input_hash
+  result.overlay = overlay.signature
+
+  # Saving the processed image, possibly in the background
+  if outputs:
+    write_overlay(image_out, outputs[0], overlay)
+  del image_out
+
+  return result
+
+
+def process_background(name: str,
+                       frame: TileFrame,
+                       entry: Optional[dict] = None) -> TileResult:
+  """Accounts for a subsection that was skipped for containing almost only
+  background.
+
+  No object nor stained area is detected on such a subsection, and its overall
+  area is the tissue area estimated on the thumbnail of the slide.
+
+  Args:
+    name: The name of the subsection, without extension.
+    frame: The frame of the subsection, holding its estimated tissue area.
+    entry: Unused, only for compatibility with the other processing functions.
+
+  Returns:
+    The estimated measurements of the subsection.
+  """
+
+  return TileResult(name=name, overall_area=frame.tissue_area)
+
+
+def process_region(slide_path: Path,
+                   label: Box,
+                   thumb_factor: int,
+                   n_slices: Union[int, Tuple[int, int]],
+                   x_id: int,
+                   y_id: int,
+                   choice: str,
+                   side_fold: Path,
+                   save_raw: bool = False,
+                   halo: int = 0,
+                   overlay: OverlayOptions = OverlayOptions(),
+                   mask_downsample: int = 1,
+                   entry: Optional[dict] = None) -> TileResult:
+  """Reads one subsection directly from a slide, processes it, and saves the
+  processed image in the Processed_images folder of its side folder.
+
+  This avoids writing the subsection to the disk and decoding it back, unless
+  save_raw is set.
+
+  Args:
+    slide_path: The path to the .ndpi file.
+    label: The box containing the target area of the slide.
+    thumb_factor: The zoom factor used for obtaining the thumbnail.
+    n_slices: The number of subsections the entire image is cut to in each
+      direction, or a tuple giving this number along the x and y axes.
+    x_id: The index of the subsection along the x-axis.
+    y_id: The index of the subsection along the y-axis.
+    choice: The type of processing to perform, one of processing_types.
+    side_fold: The side folder where to store the results.
+    save_raw: If True, the subsection is also saved in the Raw_images folder.
+    halo: The number of pixels by which the subsection is extended on each
+      side, overlapping with the neighbouring subsections.
+    overlay: How to write the processed image, if at all.
+    mask_downsample: The factor by which the image is shrunk for detecting
+      the section areas.
+    entry: The manifest entry of the subsection from a previous run, if any.
+      If it matches the current region, type of processing and options, the
+      region is not processed again and the recorded result is returned.
+
+  Returns:
+    The measurements performed on the image.
+  """
+
+  name = f'Section_{x_id + 1}_{y_id + 1}.png'
+
+  # Skipping the subsection if it was already processed
+  input_hash = hash_region(slide_path, label.bbox, thumb_factor, n_slices,
+                           x_id, y_id, halo)
+  outputs = list()
+  if overlay.enabled:
+    outputs.append(overlay.path(side_fold / 'Processed_images',
+                                Path(name).stem))
+  if save_raw:
+    outputs.append(side_fold / 'Raw_images' / name)
+  if _is_done(entry, input_hash, choice, mask_downsample, overlay, *outputs):
+    return TileResult.from_entry(Path(name).stem, entry)
+
+  # Reading the subsection and optionally saving it
+  tile = Tile(get_portion(_get_slide(slide_path), label, thumb_factor,
+                          n_slices, x_id, y_id, halo))
+  if save_raw:
+    with stage('png encode'):
+      tile.image.save(side_fold / 'Raw_images' / name)
+
+  # Processing the subsection and saving the processed image
+  frame = get_tiling(label, thumb_factor, n_slices, halo)[Path(name).stem]
+  result, image_out = process_image(tile, choice, frame, overlay.enabled,
+                                    mask_downsample)
+  result.name = Path(name).stem
+  result.input_hash = input_hash
+  result.overlay = overlay.signature
+  del tile
+  if overlay.enabled:
+    write_overlay(image_out, outputs[0], overlay)
+  del image_out
+
+  return result
+
+
+def write_data_sheet(path: Path,
+                     choice: str,
+                     results: List[TileResult]) -> None:
+  """Writes the measurements performed on all the subsections of a side
+  folder to an Excel file.
+
+  The file is written in constant memory mode, one full row at a time, so
+  that sheets with many objects are written quickly.
+
+  Args:
+    path: The path to the Excel file to write.
+    choice: The type of processing that was performed.
+    results: The measurements performed on each subsection, in order.
+  """
+
+  with Workbook(str(path), {'constant_memory': True}) as excel:
+    worksheet = excel.add_worksheet()
+    bold = excel.add_format({'bold': True, 'align': 'center'})
+
+    overall_area = sum(result.overall_area for result in results)
+
+    # Writing one line per detected object
+    if choice in object_types:
+      name = object_types[choice]
+      worksheet.write_row(0, 0, (f"{name} index",
+                                 *(f"{name} {col}" for col
+                                   in object_columns.values()),
+                                 "", "Overall area"), bold)
+
+      # Gathering the measurements of all the subsections in columns
+      columns = [np.concatenate([result.objects[prop] for result in results]
+                                + [np.empty(0)]).tolist()
+                 for prop in object_columns]
+
+      for index, values in enumerate(zip(*columns), start=1):
+        worksheet.write_row(index, 0, (index, *values))
+
+        # Writing the overall section area on the first line
+        if index == 1:
+          worksheet.write(1, 5, overall_area)
+
+      # In case no object was detected
+      if not columns[0]:
+        worksheet.write(1, 5, overall_area)
+
+    # Only writing the overall and stained areas
+    else:
+      worksheet.write(0, 0, "Stained area", bold)
+      worksheet.write(0, 1, sum(result.stained_area for result in results))
+      worksheet.write(1, 0, "Overall area", bold)
+      worksheet.write(1, 1, overall_area)
+
+
+def write_data_files(side_fold: Path,
+                     choice: str,
+                     results: List[TileResult],
+                     excel: bool = True) -> None:
+  """Writes the results of a side folder to its data.npz file, and optionally
+  to its data.xlsx file.
+
+  Args:
+    side_fold: The side folder whose results to write.
+    choice: The type of processing that was performed.
+    results: The measurements performed on each subsection, in order.
+    excel: If False, the data.xlsx file is not written.
+  """
+
+  write_results(side_fold / results_file_name, choice,
+                side_fold.parent.name, side_fold.name,
+                [result.name for result in results],
+                [result.overall_area for result in results],
+                [result.stained_area for result in results],
+                [result.objects for result in results],
+                (*object_columns, *position_columns))
+
+  if excel:
+    write_data_sheet(side_fold / 'data.xlsx', choice, results)
+
+
+def _write_pyramids(side_fold: Path,
+                    fold_tasks: List[Tuple[str, Callable, tuple]],
+                    overlay: OverlayOptions) -> None:
+  """Assembles the subsections of a side folder processed during this run
+  into pyramidal images, if requested by the options."""
+
+  if not (overlay.pyramid or overlay.pyramid_raw):
+    return
+
+  print(f"Now writing the pyramidal images of : "
+        f"{side_fold.parent.stem}/{side_fold.name}")
+  write_side_pyramids(side_fold, overlay,
+                      [name for name, _, _ in fold_tasks])
+
+
+def _process_all(tasks: Dict[Path, List[Tuple[str, Callable, tuple]]],
+                 choice: str,
+                 progress,
+                 workers: int = 1,
+                 excel: bool = True,
+                 resume: bool = True,
+                 overlay: OverlayOptions = OverlayOptions(),
+                 overlay_queue: int = 4) -> None:
+  """Runs the processing of all the subsections, either sequentially or in a
+  pool of worker processes, and writes the data files of each side folder.
+
+  In the sequential mode, the processed images are written by a background
+  thread while the next subsections are processed. In the parallel mode, each
+  worker writes its own images, the encoding being already spread over the
+  workers.
+
+  In the parallel mode, the subsections of all the side folders are processed
+  concurrently, and the data files of a side folder are written as soon as
+  all its subsections are done. The results are gathered in the same order as
+  in the sequential mode, so that the data files are identical. The
+  pyramidal images of a side folder are also written as soon as all its
+  subsections are done, if requested.
+
+  The result of each subsection is appended to the manifest of its side
+  folder as soon as it is available. The manifest is rewritten with a single
+  entry per subsection of the current run at the start, and once the folder
+  is done. When resuming, the
+  subsections whose input and type of processing match their manifest entry
+  are not processed again.
+
+  Args:
+    tasks: For each side folder, the name of each of its subsections, the
+      function processing it and its arguments. The functions must accept an
+      entry keyword argument receiving the manifest entry of the subsection,
+      and return a TileResult.
+    choice: The type of processing that is performed.
+    progress: The progress window or console to update.
+    workers: The number of worker processes to use. If 1, everything is
+      processed in the current process.
+    excel: If False, only the data.npz files are written and not the
+      data.xlsx ones.
+    resume: If False, the existing manifests are ignored and all the
+      subsections are processed again.
+    overlay: How the processed images are written, and whether to assemble
+      the subsections of each side folder into pyramidal images.
+    overlay_queue: In the sequential mode, the maximum number of processed
+      images waiting for being written by the background thread.
+  """
+
+  nb_fold = len(tasks)
+
+  for side_fold in tasks:
+    Path.mkdir(side_fold / 'Processed_images', exist_ok=True, parents=True)
+
+  # Loading the results of the previous runs, and rewriting the manifests
+  # without their outdated or incomplete lines before appending to them. The
+  # entries of the subsections that are not part of this run are dropped
+  manifests = dict()
+  for side_fold, fold_tasks in tasks.items():
+    names = {name for name, _, _ in fold_tasks}
+    manifests[side_fold] = {
+      name: entry for name, entry
+      in (load_manifest(side_fold) if resume else dict()).items()
+      if name in names}
+    save_manifest(side_fold, manifests[side_fold])
+
+  # Processing the side folders one after the other
+  if workers <= 1:
+    section = None
+    start_writer(overlay_queue)
+    try:
+      for fold_count, (side_fold, fold_tasks) in enumerate(tasks.items()):
+
+        if side_fold.parent != section:
+          section = side_fold.parent
+          print(f"Now processing the section : {section.stem}")
+
+        # Updating the progress bar
+        progress.top_progress.set(int(100 * fold_count / nb_fold))
+        progress.update()
+
+        # Iterating over the subsections for processing
+        results = list()
+        manifest = manifests[side_fold]
+        for i, (name, func, args) in enumerate(fold_tasks):
+
+          # Updating the progress bar
+          progress.bottom_progress.set(int(100 * i / len(fold_tasks)))
+          progress.update()
+
+          with trace_tile(name):
+            results.append(func(*args, entry=manifest.get(name)))
+
+          # Recording the result in the manifest
+          manifest[name] = results[-1].to_entry(choice)
+          append_manifest(side_fold, name, manifest[name])
+
+        write_data_files(side_fold, choice, results, excel)
+        save_manifest(side_fold, manifest)
+
+        # The processed images must all be written before assembling them
+        if overlay.pyramid:
+          wait_writer()
+        _write_pyramids(side_fold, fold_tasks, overlay)
+
+    # Waiting for the last processed images to be written
+    finally:
+      stop_writer()
+      close_slides()
+      buffer_pool.clear()
+    return
+
+  nb_img = sum(len(fold_tasks) for fold_tasks in tasks.values())
+  print(f"Now processing {nb_img} subsections in {nb_fold} folders using "
+        f"{workers} workers")
+
+  # When tracing, the workers send back their events along with the results
+  tracing = tracing_enabled()
+
+  def submit(executor, name, func, args, entry):
+    if tracing:
+      return executor.submit(run_traced, memory_tracing(), name, func, *args,
+                             entry=entry)
+    return executor.submit(func, *args, entry=entry)
+
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+
+    # Submitting all the subsections at once, keeping track of their folder
+    futures = {side_fold: [submit(executor, name, func, args,
+                                  manifests[side_fold].get(name))
+                           for name, func, args in fold_tasks]
+               for side_fold, fold_tasks in tasks.items()}
+    folder_of = {future: side_fold for side_fold, fold_futures
+                 in futures.items() for future in fold_futures}
+    remaining = {side_fold: len(fold_futures) for side_fold, fold_futures
+                 in futures.items()}
+    results = dict()
+
+    fold_count = 0
+    for img_count, future in enumerate(as_completed(folder_of), start=1):
+
+      # Raising any exception that occurred in a worker
+      result = future.result()
+      if tracing:
+        result, events = result
+        add_events(events)
+      results[future] = result
+
+      # Recording the result in the manifest
+      side_fold = folder_of[future]
+      manifests[side_fold][result.name] = result.to_entry(choice)
+      append_manifest(side_fold, result.name,
+                      manifests[side_fold][result.name])
+
+      # Writing the data file once all the subsections of a folder are done
+      remaining[side_fold] -= 1
+      if not remaining[side_fold]:
+        write_data_files(side_fold, choice,
+                         [results.pop(fut) for fut in futures[side_fold]],
+                         excel)
+        save_manifest(side_fold, manifests[side_fold])
+        _write_pyramids(side_fold, tasks[side_fold], overlay)
+        fold_count += 1
+
+      # Updating the progress bar
+      progress.top_progress.set(int(100 * fold_count / nb_fold))
+      progress.bottom_progress.set(int(100 * img_count / nb_img))
+      progress.update()
+
+    # Side folders without any subsection still get a data file
+    for side_fold, fold_futures in futures.items():
+      if not fold_futures:
+        write_data_files(side_fold, choice, [], excel)
+
+
+def process_side_folders(side_folders: List[Path],
+                         choice: str,
+                         progress,
+                         workers: int = 1,
+                         excel: bool = True,
+                         resume: bool = True,
+                         overlay: OverlayOptions = OverlayOptions(),
+                         mask_downsample: int = 1) -> None:
+  """Processes the subsections stored in the Raw_images folder of all the
+  given side folders, and writes the data files of each side folder.
+
+  Args:
+    side_folders: The side folders to process.
+    choice: The type of processing to perform, one of processing_types.
+    progress: The progress window or console to update.
+    workers: The number of worker processes to use. If 1, everything is
+      processed in the current process.
+    excel: If False, only the data.npz files are written and not the
+      data.xlsx ones.
+    resume: If False, the subsections already processed during a previous run
+      are processed again.
+    overlay: How to write the processed images, if at all, and whether to
+      assemble the subsections of each side folder into pyramidal images.
+    mask_downsample: The factor by which the subsections are shrunk for
+      detecting the section areas when counting the overall area.
+  """
+
+  tasks = dict()
+  for side_fold in side_folders:
+    tiling = load_tiling(side_fold)
+    skipped = [name for name, frame in tiling.items() if frame.skipped]
+    tasks[side_fold] = [(image_path.stem, process_tile,
+                         (image_path, choice, tiling.get(image_path.stem),
+                          overlay, mask_downsample))
+                        for image_path
+                        in (side_fold / 'Raw_images').glob('*.png')
+                        if image_path.stem not in skipped]
+
+    # The subsections skipped at extraction only count for their tissue area
+    tasks[side_fold].extend((name, process_background, (name, tiling[name]))
+                            for name in skipped)
+
+  _process_all(tasks, choice, progress, workers, excel, resume, overlay)
+
+
+def process_slides(chosen_images: Dict[Path, List[Box]],
+                   choice: str,
+                   progress,
+                   nb_tile: int = 4,
+                   workers: int = 1,
+                   save_raw: bool = False,
+                   excel: bool = True,
+                   resume: bool = True,
+                   halo: int = 0,
+                   memory_budget: Optional[float] = None,
+                   min_coverage: float = 0.,
+                   overlay: OverlayOptions = OverlayOptions(),
+                   mask_downsample: int = 1) -> None:
+  """Reads the selected sections directly from the slides and processes them,
+  without going through the .png images of the Raw_images folders.
+
+  The results are stored in the same side folders as the ones created by
+  selection.py, so that the output is the same as extracting the sections and
+  processing them afterwards.
+
+  Args:
+    chosen_images: For each .ndpi file, the list of the sections to process.
+    choice: The type of processing to perform, one of processing_types.
+    progress: The progress window or console to update.
+    nb_tile: The number of subsections in each direction.
+    workers: The number of worker processes to use. If 1, everything is
+      processed in the current process.
+    save_raw: If True, the subsections are also saved in the Raw_images
+      folders.
+    excel: If False, only the data.npz files are written and not the
+      data.xlsx ones.
+    resume: If False, the subsections already processed during a previous run
+      are processed again.
+    halo: The number of pixels by which the subsections are extended on each
+      side, overlapping with their neighbours.
+    memory_budget: The maximum memory for processing one subsection, in bytes.
+      If given, each section is cut into as many subsections as needed for
+      fitting in it, instead of nb_tile in each direction.
+    min_coverage: The subsections whose fraction covered by tissue, as
+      estimated on the thumbnail of the slide, is below this value are not
+      read nor processed. Only their estimated tissue area is accounted for
+      in the overall area.
+    overlay: How to write the processed images, if at all, and whether to
+      assemble the subsections of each side folder into pyramidal images.
+    mask_downsample: The factor by which the subsections are shrunk for
+      detecting the section areas when counting the overall area.
+  """
+
+  tasks = dict()
+  for img_path, j, label, factor_thumb, grid, tiling in list_sections(
+      chosen_images, nb_tile, memory_budget, halo, min_coverage):
+    side_fold = get_side_folder(img_path, j)
+
+    # Creating the side folder and describing its subsections
+    Path.mkdir(side_fold, exist_ok=True, parents=True)
+    if save_raw:
+      Path.mkdir(side_fold / 'Raw_images', exist_ok=True, parents=True)
+    save_tiling(side_fold, tiling)
+
+    tasks[side_fold] = list()
+    for x, y in iter_grid(grid):
+      name = f'Section_{x + 1}_{y + 1}'
+
+      # The subsections with too little tissue are not read from the slide
+      if tiling[name].skipped:
+        tasks[side_fold].append((name, process_background,
+                                 (name, tiling[name])))
+      else:
+        tasks[side_fold].append(
+          (name, process_region,
+           (img_path, label, factor_thumb, grid, x, y, choice, side_fold,
+            save_raw, halo, overlay, mask_downsample)))
+
+  _process_all(tasks, choice, progress, workers, excel, resume, overlay)
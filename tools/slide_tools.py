@@ -1,6 +1,7 @@
 # coding: utf-8
 
 from PIL import Image
+from typing import Tuple, Union
 # Python >= 3.8 on Windows
 import os
 from pathlib import Path
@@ -11,6 +12,8 @@ if hasattr(os, 'add_dll_directory'):
 else:
   from openslide import OpenSlide
 
+from .trace import stage
+
 
 def get_image(ndpi_slide: OpenSlide,
               img_label,
@@ -50,12 +53,48 @@ def get_image(ndpi_slide: OpenSlide,
   return ndpi_slide.read_region((min_x, min_y), ratio, (x_size, y_size))
 
 
+def get_portion_coordinates(img_label,
+                            thumb_factor: int,
+                            n_slices: Union[int, Tuple[int, int]],
+                            x_id: int,
+                            y_id: int) -> Tuple[int, int, int, int]:
+  """Function that computes the position of a subsection of a zone of a slide
+  in the 0 zoom level.
+
+  Args:
+    img_label: The scikit-image label containing the target area of the slide.
+    thumb_factor: The zoom factor used for obtaining the first image.
+    n_slices: The number of subsections the entire image will be cut to in each
+      direction, or a tuple giving this number along the x and y axes.
+    x_id: The index of the subsection along the x-axis.
+    y_id: The index of the subsection along the y-axis.
+
+  Returns:
+    The x and y coordinates of the origin of the subsection on the slide, and
+    its dimensions along x and y, all in the 0 zoom level.
+  """
+
+  min_y, min_x, max_y, max_x = img_label.bbox
+  n_x, n_y = (n_slices, n_slices) if isinstance(n_slices, int) else n_slices
+
+  # Calculating the dimension of the subsection
+  x_size = int((max_x - min_x) * (2 ** thumb_factor) / n_x)
+  y_size = int((max_y - min_y) * (2 ** thumb_factor) / n_y)
+
+  # Calculating the origin of the subsection
+  min_x = min_x * 2 ** thumb_factor + x_id * x_size
+  min_y = min_y * 2 ** thumb_factor + y_id * y_size
+
+  return min_x, min_y, x_size, y_size
+
+
 def get_portion(ndpi_slide: OpenSlide,
                 img_label,
                 thumb_factor: int,
-                n_slices: int,
+                n_slices: Union[int, Tuple[int, int]],
                 x_id: int,
-                y_id: int) -> Image:
+                y_id: int,
+                halo: int = 0) -> Image:
   """Function that takes a zone of a slide as an input, and returns a
   subsection of this zone in the 0 zoom level.
 
@@ -64,26 +103,23 @@ def get_portion(ndpi_slide: OpenSlide,
     img_label: The scikit-image label containing the target area of the slide.
     thumb_factor: The zoom factor used for obtaining the first image.
     n_slices: The number of subsections the entire image will be cut to in each
-      direction.
+      direction, or a tuple giving this number along the x and y axes.
     x_id: The index of the subsection along the x-axis.
     y_id: The index of the subsection along the y-axis.
+    halo: The number of pixels by which the subsection is extended on each
+      side, overlapping with the neighbouring subsections.
 
   Returns:
     A subsection of the input image in the 0 zoom level.
   """
 
-  min_y, min_x, max_y, max_x = img_label.bbox
-
-  # Calculating the dimension of the subsection
-  x_size = int((max_x - min_x) * (2 ** thumb_factor) / n_slices)
-  y_size = int((max_y - min_y) * (2 ** thumb_factor) / n_slices)
-
-  # Calculating the origin of the subsection
-  min_x = min_x * 2 ** thumb_factor + x_id * x_size
-  min_y = min_y * 2 ** thumb_factor + y_id * y_size
+  min_x, min_y, x_size, y_size = get_portion_coordinates(
+    img_label, thumb_factor, n_slices, x_id, y_id)
 
-  # Returning the actual subsection
-  return ndpi_slide.read_region((min_x, min_y), 0, (x_size, y_size))
+  # Returning the actual subsection, extended by the halo
+  with stage('read_region'):
+    return ndpi_slide.read_region((min_x - halo, min_y - halo), 0,
+                                  (x_size + 2 * halo, y_size + 2 * halo))
 
 
 def get_thumbnail(open_slide, max_size):
@@ -0,0 +1,86 @@
+# coding: utf-8
+
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from skimage import measure, morphology
+import cv2
+
+from .pipeline import Pipeline, All, Channel, Stretch, AutoStretch, \
+  Threshold, Morphology, Apply
+from .processing_tools import vessel_mask, detect_vessels
+from .contrast import apply_lut
+from .buffers import buffer_pool
+
+
+@dataclass(frozen=True)
+class Stain:
+  """Describes the processing of a type of staining.
+
+  The pipeline either returns the mask of the stained area, or if object_name
+  is set, an image on which each detected object has a different label. The
+  color is the one of the stained area on the processed image, or the one of
+  the outlines of the objects.
+  """
+
+  pipeline: Pipeline
+  object_name: Optional[str] = None
+  color: Tuple[int, int, int] = (0, 0, 255)
+
+  def overlay(self, stained: np.ndarray) -> np.ndarray:
+    """Returns the image marking the stained area with the color of the
+    stain on a white background.
+
+    Args:
+      stained: The uint8 mask of the stained area, either 0 or 255.
+
+    Returns:
+      The RGB image, taken from the buffer pool.
+    """
+
+    return apply_lut(stained, _overlay_lut(self.color),
+                     buffer_pool.get((*stained.shape, 3)))
+
+
+def _overlay_lut(color: Tuple[int, int, int]) -> np.ndarray:
+  """Returns the lookup table mapping the background of a mask to white and
+  the selected pixels to the given color, one RGB row per mask value."""
+
+  lut = np.full((256, 3), 255, dtype=np.uint8)
+  lut[255] = color
+  return lut
+
+
+def _label(mask: np.ndarray) -> np.ndarray:
+  """Assigns a different label to each object of a mask."""
+
+  return measure.label(mask, background=0, connectivity=2)
+
+
+def _remove_small_bundles(labels: np.ndarray) -> np.ndarray:
+  """Removes the objects too small to be S100 bundles."""
+
+  return morphology.remove_small_objects(labels, 500, connectivity=2)
+
+
+# The processing of each type of staining, in the order of processing_types
+stains: Dict[str, Stain] = {
+  'Blood vessels': Stain((*vessel_mask, Apply(detect_vessels)),
+                         object_name='Vessel', color=(0, 255, 0)),
+  'Alcian blue': Stain((Channel('rgb', 0), Stretch(92, 221),
+                        Threshold(high=179)),
+                       color=(0, 0, 255)),
+  'Laminin': Stain((Channel('ycbcr', 2), Stretch(130, 145),
+                    Threshold(low=121)),
+                   color=(255, 0, 0)),
+  'MvG': Stain((All((Channel('rgb', 0), Threshold(high=169)),
+                    (Channel('rgb', 1), Threshold(high=169)),
+                    (Channel('rgb', 2), Threshold(high=169))),),
+               color=(0, 0, 0)),
+  'MSB': Stain((Channel('rgb', 0), Stretch(79, 233), Threshold(high=179)),
+               color=(0, 0, 255)),
+  'S100': Stain((Channel('ycbcr', 2), AutoStretch(99.5, 50, min_upper=138),
+                 Threshold(low=181), Morphology(cv2.MORPH_OPEN, 5),
+                 Morphology(cv2.MORPH_CLOSE, 70), Apply(_label),
+                 Apply(_remove_small_bundles)),
+                object_name='Bundle', color=(0, 255, 0))}
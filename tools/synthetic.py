@@ -0,0 +1,132 @@
+# coding: utf-8
+
+import numpy as np
+from PIL import Image
+from typing import Tuple
+import cv2
+
+# The colors of the synthetic tiles, in RGB
+_background = (242, 242, 242)
+_tissue = (225, 170, 200)
+_stains = ((140, 90, 60), (60, 90, 170), (120, 40, 80))
+
+
+def synthetic_tile(width: int = 2048,
+                   height: int = 2048,
+                   density: float = 50.,
+                   seed: int = 0,
+                   tissue: float = 0.8) -> np.ndarray:
+  """Generates a subsection image looking like a stained section, for
+  benchmarking the processing without any real slide.
+
+  The tile holds an elliptic tissue area on a light background, with stained
+  objects scattered on the tissue. Half of them are rings, i.e. objects with a
+  hole like blood vessels, and the other half are filled disks.
+
+  Args:
+    width: The width of the tile in pixels.
+    height: The height of the tile in pixels.
+    density: The number of stained objects per megapixel.
+    seed: The seed of the random generator, for reproducible tiles.
+    tissue: The size of the tissue area relative to the tile.
+
+  Returns:
+    The RGBA tile, as an uint8 array.
+  """
+
+  rng = np.random.default_rng(seed)
+  img = np.empty((height, width, 3), dtype=np.uint8)
+  img[:] = _background
+
+  # The tissue area
+  center = (width // 2, height // 2)
+  axes = (int(tissue * width / 2), int(tissue * height / 2))
+  cv2.ellipse(img, center, axes, 0, 0, 360, _tissue, -1)
+
+  # The stained objects, only placed on the tissue
+  nb_obj = int(density * width * height / 1e6)
+  for _ in range(nb_obj):
+    angle = rng.uniform(0, 2 * np.pi)
+    dist = np.sqrt(rng.uniform(0, 1))
+    pos = (int(center[0] + dist * axes[0] * np.cos(angle)),
+           int(center[1] + dist * axes[1] * np.sin(angle)))
+    radius = int(rng.integers(5, 40))
+    thickness = -1 if rng.random() < 0.5 else int(rng.integers(2, 8))
+    color = _stains[int(rng.integers(len(_stains)))]
+    cv2.circle(img, pos, radius, color, thickness)
+
+  # Adding some noise, like on a real scan
+  noise = rng.integers(-6, 7, size=img.shape, dtype=np.int16)
+  img = np.clip(img + noise, 0, 255).astype(np.uint8)
+
+  alpha = np.full((height, width, 1), 255, dtype=np.uint8)
+  return np.concatenate((img, alpha), axis=2)
+
+
+class FakeSlide:
+  """Stand-in for an OpenSlide object, serving a synthetic slide.
+
+  The slide is made of a synthetic tile repeated over its whole surface, and
+  only has one level. The regions outside of the slide are transparent, like
+  with OpenSlide.
+  """
+
+  def __init__(self,
+               dimensions: Tuple[int, int] = (40000, 20000),
+               tile_size: int = 2048,
+               density: float = 50.,
+               seed: int = 0) -> None:
+    """Generates the tile the slide is made of.
+
+    Args:
+      dimensions: The width and height of the slide in pixels.
+      tile_size: The size of the repeated synthetic tile.
+      density: The number of stained objects per megapixel.
+      seed: The seed of the random generator.
+    """
+
+    self.dimensions = dimensions
+    self.level_count = 1
+    self.level_dimensions = (dimensions,)
+    self.level_downsamples = (1.,)
+    self._tile = synthetic_tile(tile_size, tile_size, density, seed,
+                                tissue=1.)
+
+  def read_region(self,
+                  location: Tuple[int, int],
+                  level: int,
+                  size: Tuple[int, int]) -> Image.Image:
+    """Returns an RGBA region of the slide, like OpenSlide.read_region."""
+
+    (x, y), (width, height) = location, size
+    tile_h, tile_w = self._tile.shape[:2]
+
+    # Repeating the tile over the region
+    rows = np.arange(y, y + height) % tile_h
+    cols = np.arange(x, x + width) % tile_w
+    region = self._tile[rows[:, None], cols[None, :]]
+
+    # Making the part outside of the slide transparent
+    outside = ((np.arange(y, y + height) < 0) |
+               (np.arange(y, y + height) >= self.dimensions[1]))[:, None] | \
+              ((np.arange(x, x + width) < 0) |
+               (np.arange(x, x + width) >= self.dimensions[0]))[None, :]
+    region[outside] = 0
+
+    return Image.fromarray(region)
+
+  def get_thumbnail(self, size: Tuple[int, int]) -> Image.Image:
+    """Returns an RGB thumbnail of the slide, like OpenSlide.get_thumbnail."""
+
+    factor = max(self.dimensions[0] / size[0], self.dimensions[1] / size[1])
+    width = int(self.dimensions[0] / factor)
+    height = int(self.dimensions[1] / factor)
+    tile = Image.fromarray(self._tile[:, :, :3])
+    tile = tile.resize((max(1, int(tile.width / factor)),
+                        max(1, int(tile.height / factor))))
+    thumb = np.tile(np.array(tile), (height // tile.height + 1,
+                                     width // tile.width + 1, 1))
+    return Image.fromarray(thumb[:height, :width])
+
+  def close(self) -> None:
+    """Nothing to release, only for compatibility with OpenSlide."""
@@ -0,0 +1,80 @@
+# coding: utf-8
+
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from functools import cached_property
+from typing import Union
+import cv2
+
+from .trace import stage
+from .buffers import buffer_pool
+
+
+class Tile:
+  """A subsection image decoded only once, whose derived channels are
+  computed on first access and then reused by all the processing steps.
+
+  The channels are computed exactly like the processing steps used to, so that
+  the results are unchanged.
+  """
+
+  def __init__(self, img: Union[Image.Image, np.ndarray]) -> None:
+    """Decodes the image.
+
+    Args:
+      img: Either the Pillow image of the subsection, or its already decoded
+        pixels.
+    """
+
+    self.array = np.array(img) if isinstance(img, Image.Image) else img
+
+  @classmethod
+  def open(cls, path: Path) -> 'Tile':
+    """Reads and decodes a subsection image from the disk."""
+
+    with stage('png decode'), Image.open(path) as img:
+      return cls(img)
+
+  @property
+  def shape(self):
+    """The shape of the decoded image."""
+
+    return self.array.shape
+
+  @property
+  def image(self) -> Image.Image:
+    """A Pillow image sharing the pixels of the decoded image."""
+
+    return Image.fromarray(self.array)
+
+  @property
+  def rgb(self) -> np.ndarray:
+    """The red, green and blue channels, without the alpha channel."""
+
+    return self.array[:, :, :3]
+
+  @cached_property
+  def gray(self) -> np.ndarray:
+    """The grey level image, as computed by :func:`detect_section`."""
+
+    with stage('gray conversion'):
+      return cv2.cvtColor(self.array, cv2.COLOR_BGR2GRAY,
+                          dst=buffer_pool.get(self.shape[:2]))
+
+  @cached_property
+  def ycbcr(self) -> np.ndarray:
+    """The image converted to the YCbCr colorspace by Pillow."""
+
+    with stage('ycbcr conversion'):
+      return np.array(self.image.convert('YCbCr'))
+
+  def release(self) -> None:
+    """Frees the memory held by the decoded image, and gives its derived
+    channels back to the buffer pool.
+
+    The channels obtained from the tile must not be used anymore afterwards.
+    """
+
+    buffer_pool.release(self.__dict__.get('gray'), self.__dict__.get('ycbcr'))
+    self.__dict__.clear()
@@ -0,0 +1,232 @@
+# coding: utf-8
+
+import json
+import re
+from math import ceil, sqrt
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+import numpy as np
+
+from .slide_tools import get_portion_coordinates
+
+# The name of the file describing how a section was cut into subsections
+tiling_file_name = 'tiling.json'
+
+# Estimate of the peak memory needed for processing one pixel of a subsection,
+# in bytes. It accounts for the RGBA image, its colour conversions, the masks,
+# the outline image, and the int64 label images and their temporaries
+bytes_per_pixel = 96
+
+
+@dataclass
+class TileFrame:
+  """Position of a subsection in its section, in the 0 zoom level.
+
+  The subsection image is extended by halo pixels on each side, so that the
+  core of the subsection, i.e. the part it is responsible for, starts at
+  (halo, halo) in the image and spans width x height pixels.
+
+  The coverage is the fraction of the core covered by tissue, as estimated on
+  the thumbnail of the slide. Subsections with too little tissue are marked
+  as skipped, and are neither extracted nor processed.
+  """
+
+  x: int
+  y: int
+  width: int
+  height: int
+  halo: int = 0
+  coverage: float = 1.
+  skipped: bool = False
+
+  @property
+  def tissue_area(self) -> int:
+    """The area of the core covered by tissue, estimated from the coverage."""
+
+    return int(round(self.coverage * self.width * self.height))
+
+  @property
+  def core(self) -> Tuple[slice, slice]:
+    """The slices selecting the core of the subsection in its image."""
+
+    return (slice(self.halo, self.halo + self.height),
+            slice(self.halo, self.halo + self.width))
+
+
+def check_memory_budget(memory_budget: float, halo: int = 0) -> None:
+  """Checks that a memory budget can hold the smallest possible subsection,
+  i.e. a single pixel extended by the halo on each side.
+
+  Args:
+    memory_budget: The maximum memory for processing one subsection, in bytes.
+    halo: The number of pixels by which the subsections are extended.
+
+  Raises:
+    ValueError: If the budget is too small.
+  """
+
+  min_budget = (2 * halo + 1) ** 2 * bytes_per_pixel
+  if memory_budget < min_budget:
+    raise ValueError(f"The memory budget should be at least "
+                     f"{min_budget / 2 ** 20:.3g} MB with a halo of {halo} "
+                     f"pixels, got {memory_budget / 2 ** 20:.3g} MB")
+
+
+def get_tile_grid(img_label,
+                  thumb_factor: int,
+                  memory_budget: float,
+                  halo: int = 0) -> Tuple[int, int]:
+  """Chooses the number of subsections of a section so that processing any
+  of them fits in a given memory budget.
+
+  The subsections are kept as square as possible, and their number is the
+  smallest one for which the estimated memory usage, based on
+  bytes_per_pixel, is within the budget.
+
+  Args:
+    img_label: The box containing the section on the thumbnail.
+    thumb_factor: The zoom factor used for obtaining the thumbnail.
+    memory_budget: The maximum memory for processing one subsection, in bytes.
+    halo: The number of pixels by which the subsections are extended.
+
+  Returns:
+    The number of subsections along the x and y axes.
+
+  Raises:
+    ValueError: If the budget can't hold a single pixel and its halo, see
+      :func:`check_memory_budget`.
+  """
+
+  check_memory_budget(memory_budget, halo)
+
+  min_y, min_x, max_y, max_x = img_label.bbox
+  width = max(1, (max_x - min_x) * 2 ** thumb_factor)
+  height = max(1, (max_y - min_y) * 2 ** thumb_factor)
+
+  # Side of the largest square subsection fitting in the budget
+  side = max(1., sqrt(memory_budget / bytes_per_pixel) - 2 * halo)
+  n_x, n_y = ceil(width / side), ceil(height / side)
+
+  # Refining until the actual subsections fit, the sizes being rounded
+  while ((width // n_x + 2 * halo) * (height // n_y + 2 * halo)
+         * bytes_per_pixel > memory_budget
+         and (width // n_x > 1 or height // n_y > 1)):
+    if width / n_x >= height / n_y:
+      n_x += 1
+    else:
+      n_y += 1
+
+  return n_x, n_y
+
+
+def get_tiling(img_label,
+               thumb_factor: int,
+               n_slices: Union[int, Tuple[int, int]],
+               halo: int = 0,
+               tissue_map: Optional[np.ndarray] = None,
+               min_coverage: float = 0.) -> Dict[str, TileFrame]:
+  """Computes the frame of each subsection of a section.
+
+  Args:
+    img_label: The box containing the section on the thumbnail.
+    thumb_factor: The zoom factor used for obtaining the thumbnail.
+    n_slices: The number of subsections in each direction, or a tuple giving
+      this number along the x and y axes.
+    halo: The number of pixels by which the subsections are extended.
+    tissue_map: A boolean image of the size of the thumbnail, True where
+      tissue was detected. If given, the tissue coverage of each subsection is
+      computed on it.
+    min_coverage: The subsections whose coverage is strictly below this
+      fraction are marked as skipped.
+
+  Returns:
+    For each subsection name, its frame in the section.
+  """
+
+  # The origin of the section, shared by all its subsections
+  origin_x, origin_y, _, _ = get_portion_coordinates(img_label, thumb_factor,
+                                                     n_slices, 0, 0)
+
+  n_x, n_y = (n_slices, n_slices) if isinstance(n_slices, int) else n_slices
+
+  tiling = dict()
+  for x_id in range(n_x):
+    for y_id in range(n_y):
+      min_x, min_y, x_size, y_size = get_portion_coordinates(
+        img_label, thumb_factor, n_slices, x_id, y_id)
+      frame = TileFrame(min_x - origin_x, min_y - origin_y, x_size, y_size,
+                        halo)
+
+      # Estimating the coverage on the footprint of the core on the thumbnail
+      if tissue_map is not None:
+        scale = 2 ** thumb_factor
+        footprint = tissue_map[round(min_y / scale):
+                               round((min_y + y_size) / scale),
+                               round(min_x / scale):
+                               round((min_x + x_size) / scale)]
+        frame.coverage = float(np.mean(footprint)) if footprint.size else 0.
+        frame.skipped = frame.coverage < min_coverage
+
+      tiling[f'Section_{x_id + 1}_{y_id + 1}'] = frame
+  return tiling
+
+
+def save_tiling(side_fold: Path, tiling: Dict[str, TileFrame]) -> None:
+  """Writes the frames of the subsections of a side folder to its tiling.json
+  file.
+
+  Args:
+    side_fold: The side folder the subsections belong to.
+    tiling: For each subsection name, its frame in the section.
+  """
+
+  with open(side_fold / tiling_file_name, 'w') as file:
+    json.dump({name: asdict(frame) for name, frame in tiling.items()}, file,
+              indent=2)
+
+
+def load_tiling(side_fold: Path) -> Dict[str, TileFrame]:
+  """Reads the frames of the subsections of a side folder.
+
+  Args:
+    side_fold: The side folder the subsections belong to.
+
+  Returns:
+    For each subsection name, its frame in the section. Empty if the side
+    folder has no tiling.json file, i.e. if it was extracted without halo.
+  """
+
+  try:
+    with open(side_fold / tiling_file_name, 'r') as file:
+      return {name: TileFrame(**frame)
+              for name, frame in json.load(file).items()}
+  except FileNotFoundError:
+    return dict()
+
+
+def get_frame(name: str,
+              shape: Tuple[int, ...],
+              tiling: Optional[Dict[str, TileFrame]] = None) -> TileFrame:
+  """Returns the frame of a subsection.
+
+  If the subsection is not described in the tiling, it is assumed to come
+  from a regular grid without halo, named Section_<x>_<y> as written by
+  selection.py, in which all the subsections have the same size.
+
+  Args:
+    name: The name of the subsection, without extension.
+    shape: The shape of the subsection image.
+    tiling: For each subsection name, its frame in the section.
+
+  Returns:
+    The frame of the subsection.
+  """
+
+  if tiling and name in tiling:
+    return tiling[name]
+
+  height, width = shape[:2]
+  match = re.fullmatch(r'Section_(\d+)_(\d+)', name)
+  x_id, y_id = (int(match[1]) - 1, int(match[2]) - 1) if match else (0, 0)
+  return TileFrame(x_id * width, y_id * height, width, height)
@@ -0,0 +1,289 @@
+# coding: utf-8
+
+import json
+import os
+import threading
+import tracemalloc
+from contextlib import nullcontext
+from functools import wraps
+from pathlib import Path
+from time import perf_counter_ns, thread_time_ns
+from typing import Callable, Dict, List, Optional
+
+# The tracer of the current process, None when tracing is disabled
+_tracer: Optional['Tracer'] = None
+
+# Returned instead of a stage when tracing is disabled, so that it costs
+# nothing
+_disabled = nullcontext()
+
+
+class Tracer:
+  """Records the stages run by the current process as Chrome trace events.
+
+  Each event holds the wall time of the stage, its CPU time, and if memory
+  tracing is enabled the peak memory allocated during the stage, as measured
+  by tracemalloc. The CPU time only counts the thread running the stage, so
+  that the work of the background writer thread is not attributed to the
+  stages of the main thread.
+
+  tracemalloc only has a single peak for the whole process, so the memory is
+  only recorded for the stages of the main thread. Their peak allocation also
+  includes what the background writer thread allocates meanwhile, and is thus
+  only an upper bound while it runs.
+  """
+
+  def __init__(self, memory: bool = True) -> None:
+    """Sets the args and starts tracing the memory if needed.
+
+    Args:
+      memory: If True, the peak memory allocated by each stage is recorded.
+    """
+
+    self.memory = memory
+    self.events: List[dict] = list()
+    self.pid = os.getpid()
+    self._local = threading.local()
+
+    if memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  @property
+  def stack(self) -> List['_Stage']:
+    """The stages currently running in the calling thread, so that the
+    stages of a background thread don't interleave with the ones of the main
+    thread."""
+
+    if not hasattr(self._local, 'stack'):
+      self._local.stack = list()
+    return self._local.stack
+
+  @property
+  def tile(self) -> Optional[str]:
+    """The name of the subsection processed by the calling thread, if
+    any."""
+
+    return getattr(self._local, 'tile', None)
+
+  @tile.setter
+  def tile(self, name: Optional[str]) -> None:
+    self._local.tile = name
+
+  def drain(self) -> List[dict]:
+    """Returns the recorded events and forgets them."""
+
+    events, self.events = self.events, list()
+    return events
+
+
+class _Stage:
+  """Context manager recording one stage to the tracer of the process."""
+
+  __slots__ = ('_tracer', '_name', '_args', '_start', '_cpu', '_memory',
+               'peak')
+
+  def __init__(self, tracer: Tracer, name: str, args: dict) -> None:
+    self._tracer = tracer
+    self._name = name
+    self._args = args
+
+  def __enter__(self) -> '_Stage':
+    tracer = self._tracer
+
+    # The peak of the enclosing stage is saved before resetting it. The other
+    # threads don't reset the peak of the process, as the stages of the main
+    # thread rely on it
+    self._memory = None
+    if tracer.memory \
+        and threading.current_thread() is threading.main_thread():
+      current, peak = tracemalloc.get_traced_memory()
+      if tracer.stack:
+        tracer.stack[-1].peak = max(tracer.stack[-1].peak, peak)
+      tracemalloc.reset_peak()
+      self._memory = self.peak = current
+
+    tracer.stack.append(self)
+    self._cpu = thread_time_ns()
+    self._start = perf_counter_ns()
+    return self
+
+  def __exit__(self, *_) -> bool:
+    end = perf_counter_ns()
+    cpu = thread_time_ns()
+    tracer = self._tracer
+    tracer.stack.pop()
+
+    args = dict(self._args)
+    args['cpu_ms'] = (cpu - self._cpu) / 1e6
+    if self._memory is not None:
+      peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+      args['peak_alloc_mb'] = (peak - self._memory) / 2 ** 20
+      if tracer.stack:
+        tracer.stack[-1].peak = max(tracer.stack[-1].peak, peak)
+    if tracer.tile is not None:
+      args.setdefault('tile', tracer.tile)
+
+    tracer.events.append({'name': self._name, 'ph': 'X',
+                          'ts': self._start / 1e3,
+                          'dur': (end - self._start) / 1e3,
+                          'pid': os.getpid(), 'tid': threading.get_ident(),
+                          'args': args})
+    return False
+
+
+def enable_tracing(memory: bool = True) -> None:
+  """Starts recording the stages run by the current process.
+
+  Args:
+    memory: If True, the peak memory allocated by each stage is also
+      recorded, which slows down the allocations.
+  """
+
+  global _tracer
+  _tracer = Tracer(memory)
+
+
+def disable_tracing() -> None:
+  """Stops recording the stages and forgets the recorded events."""
+
+  global _tracer
+  if _tracer is not None and _tracer.memory and tracemalloc.is_tracing():
+    tracemalloc.stop()
+  _tracer = None
+
+
+def tracing_enabled() -> bool:
+  """Returns True if the stages of the current process are recorded."""
+
+  return _tracer is not None
+
+
+def stage(name: str, **args):
+  """Returns a context manager recording the enclosed code as a stage.
+
+  Args:
+    name: The name of the stage.
+    **args: Additional values to store in the event.
+  """
+
+  return _disabled if _tracer is None else _Stage(_tracer, name, args)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+  """Decorator recording each call of a function as a stage.
+
+  Args:
+    name: The name of the stage, defaults to the name of the function.
+  """
+
+  def decorator(func: Callable) -> Callable:
+    stage_name = name if name is not None else func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+      if _tracer is None:
+        return func(*args, **kwargs)
+      with _Stage(_tracer, stage_name, dict()):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+  return decorator
+
+
+class trace_tile:
+  """Context manager recording the processing of a subsection as a stage,
+  and tagging all the stages it contains with the name of the subsection."""
+
+  def __init__(self, name: str) -> None:
+    self._name = name
+    self._stage = _disabled
+
+  def __enter__(self) -> None:
+    if _tracer is not None:
+      _tracer.tile = self._name
+      self._stage = _Stage(_tracer, 'tile', dict())
+      self._stage.__enter__()
+
+  def __exit__(self, *exc) -> bool:
+    if _tracer is not None:
+      self._stage.__exit__(*exc)
+      _tracer.tile = None
+    return False
+
+
+def run_traced(memory: bool,
+               name: str,
+               func: Callable,
+               *args,
+               **kwargs) -> tuple:
+  """Runs the processing of a subsection in a worker process while tracing
+  it, and returns the recorded events along with the result.
+
+  Args:
+    memory: If True, the peak memory allocated by each stage is recorded.
+    name: The name of the subsection.
+    func: The function to run.
+    *args: The positional arguments of the function.
+    **kwargs: The keyword arguments of the function.
+
+  Returns:
+    The result of the function, and the events recorded while running it.
+  """
+
+  # A forked worker inherits the tracer of its parent along with the events
+  # it had already recorded, so it starts its own instead
+  if _tracer is None or _tracer.pid != os.getpid():
+    enable_tracing(memory)
+  with trace_tile(name):
+    result = func(*args, **kwargs)
+  return result, _tracer.drain()
+
+
+def add_events(events: List[dict]) -> None:
+  """Adds the events recorded by a worker process to the ones of the current
+  process."""
+
+  if _tracer is not None:
+    _tracer.events.extend(events)
+
+
+def memory_tracing() -> bool:
+  """Returns True if the peak memory of the stages is recorded."""
+
+  return _tracer is not None and _tracer.memory
+
+
+def summarize() -> Dict[str, dict]:
+  """Sums up the recorded events per stage.
+
+  Returns:
+    For each stage name, its number of calls, its total wall and CPU times in
+    seconds, and its largest peak allocation in MB.
+  """
+
+  summary = dict()
+  for event in (_tracer.events if _tracer is not None else ()):
+    entry = summary.setdefault(event['name'], {'calls': 0, 'wall_s': 0.,
+                                               'cpu_s': 0.,
+                                               'peak_alloc_mb': 0.})
+    entry['calls'] += 1
+    entry['wall_s'] += event['dur'] / 1e6
+    entry['cpu_s'] += event['args']['cpu_ms'] / 1e3
+    entry['peak_alloc_mb'] = max(entry['peak_alloc_mb'],
+                                 event['args'].get('peak_alloc_mb', 0.))
+  return summary
+
+
+def save_trace(path: Path) -> None:
+  """Writes the recorded events to a Chrome trace file, that can be opened
+  in chrome://tracing or in Perfetto.
+
+  Args:
+    path: The path to the .json file to write.
+  """
+
+  with open(path, 'w') as file:
+    json.dump({'traceEvents': _tracer.events if _tracer is not None else [],
+               'displayTimeUnit': 'ms',
+               'otherData': {'summary': summarize()}}, file)